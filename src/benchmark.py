@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+
+# Times each stage of the analysis on a synthetic WaveDump database (see
+# synthetic_wavedump.py) and reports events per second. The stages are the same
+# calls processSQL.py and analyze_event.py make, without logging or plotting.
+#
+# With --check, the signal intervals of detect_signals and the angles of the triple
+# solver are compared with straightforward per-sample and per-triple reference
+# implementations, and the plane wave fit is compared with the injected directions.
+#
+# Usage: python benchmark.py [-db synthetic.db] [-events 500] [--check]
+
+import argparse
+import os
+import tempfile
+import time as clock
+from collections import OrderedDict
+import numpy as np
+
+import spectral
+from calibration import Calibration
+from coincidence import find_coincidences
+from envelope import create_envelopes, ENVELOPE_MODES, SPLINE
+from frequencyCut import FilterBank, DEFAULT_FILTER
+from reconstruction import (AntennaLayout, ANTENNA_POSITIONS, POLARITIES, SPEED_OF_LIGHT, coincidence_times,
+                            collect_triples, direction_angles, triple_rotation)
+from sample_decoder import decode_events
+from signal_detection import detect_signals, signal_amplitudes, MAX_SIGNAL_WIDTH, SIGNAL_THRESHOLD
+from synthetic_wavedump import generate, load_truth, sample_times
+from wavedump_db import connect_readonly, index_samples, iter_event_chunks, read_settings
+
+
+BIN_RANGE = 20 # Default bin range of processSQL.py in samples
+ANALYSIS_WINDOW = (-2000, 100) # X_MIN and X_MAX of analyze_event.py in ns
+STAGES = ["read", "decode", "calibration", "fft_filter", "envelope", "detection", "coincidence", "reconstruction"]
+
+
+class StageTimer(object):
+
+    def __init__(self):
+        self.seconds = OrderedDict((stage, 0.0) for stage in STAGES)
+
+    def __call__(self, stage, function, *args):
+        start = clock.perf_counter()
+        result = function(*args)
+        self.seconds[stage] += clock.perf_counter() - start
+
+        return result
+
+
+# Runs the analysis stages over all events of conn. Returns the StageTimer, the number
+# of events and, per event, (event_id, signals, coincidences, fit results).
+def run_stages(conn, bin_range = BIN_RANGE, envelope_mode = SPLINE, filter_name = DEFAULT_FILTER, fft_length = spectral.TRIM):
+    timer = StageTimer()
+
+    sampling_freq, record_length, post_trigger = read_settings(conn)
+    calibration = Calibration.from_db(conn)
+    filter_bank = FilterBank.from_names([filter_name])
+    layout = AntennaLayout(ANTENNA_POSITIONS)
+
+    plan = spectral.fft_plan(record_length, fft_length)
+    time = np.round(sample_times(record_length, post_trigger, sampling_freq)[plan.trim])
+    window = slice(np.flatnonzero(time == ANALYSIS_WINDOW[0])[0], np.flatnonzero(time == ANALYSIS_WINDOW[1])[0] + 1)
+    time_cut = time[window]
+
+    results = []
+    chunks = iter_event_chunks(conn)
+    while True:
+        chunk = timer("read", next, chunks, None)
+        if chunk is None:
+            break
+
+        adcBlock = timer("decode", decode_events, [texts for _, _, texts in chunk], len(calibration), record_length)
+        adcBlock = timer("calibration", lambda: calibration.to_mv(adcBlock[:, :, plan.trim]))
+
+        cutBlock = timer("fft_filter", lambda: plan.inverse(filter_bank.apply(plan.forward(adcBlock), plan.size, sampling_freq)[0]))
+
+        for (event_id, _, _), cut_list in zip(chunk, cutBlock):
+            envelopes = timer("envelope", create_envelopes, cut_list[:, window], envelope_mode)
+            signals = timer("detection", detect_signals, time_cut, envelopes, bin_range)
+            groups = timer("coincidence", find_coincidences, signals, len(cut_list))
+            fits = [timer("reconstruction", layout.fit, coincidence_times(group.signals, len(layout))) for group in groups]
+            results.append((event_id, time_cut, envelopes, signals, groups, fits))
+
+    return timer, len(results), results
+
+
+def report(timer, events):
+    total = sum(timer.seconds.values())
+    print("{:<16}{:>12}{:>14}{:>9}".format("stage", "seconds", "events/s", "share"))
+    for stage, seconds in timer.seconds.items():
+        rate = events / seconds if seconds > 0 else float("inf")
+        print("{:<16}{:>12.3f}{:>14.1f}{:>8.1f}%".format(stage, seconds, rate, 100 * seconds / total))
+    print("{:<16}{:>12.3f}{:>14.1f}".format("total", total, events / total))
+
+
+# The sample by sample window search which detect_signals replaces
+def reference_signals(time, env_list, bin_range):
+    signal_found = False
+    signal_list = []
+    for chan_num, env in enumerate(env_list):
+        chan_mean = np.mean(env)
+        threshold = (np.max(env) - chan_mean) * SIGNAL_THRESHOLD
+        for i in range(0, len(time) - bin_range):
+            diff = np.mean(np.real(env[i : (i + bin_range)])) - chan_mean
+            if diff > threshold and signal_found is False:
+                signal_found = True
+                signal_begin = time[i]
+            elif ((diff < threshold) or (i == len(time) - bin_range - 1)) and signal_found is True:
+                signal_found = False
+                signal_end = time[i + bin_range]
+                if (signal_begin != time[0] and signal_end != time[-1]) and ((signal_end - signal_begin) < MAX_SIGNAL_WIDTH):
+                    signal_list.append([chan_num, signal_begin, signal_end])
+
+    return signal_list
+
+
+# The reference signals without those carried over into the next channel. Only a signal
+# opened in the last window of a channel is still open at its end, and detect_signals
+# drops it instead of closing it in the next channel.
+def reference_signals_in_channel(time, env_list, bin_range):
+    last_begin = time[len(time) - bin_range - 1]
+    return [signal for signal in reference_signals(time, env_list, bin_range) if signal[1] != last_begin]
+
+
+# The direction of one antenna triple as find_direction computed it
+def reference_direction(antennas, times):
+    rotation = triple_rotation(antennas)
+    r = [rotation.dot(antenna) for antenna in antennas]
+    denominator = ((r[2][0] - r[0][0]) * (r[1][1] - r[0][1])) - ((r[1][0] - r[0][0]) * (r[2][1] - r[0][1]))
+    d_x = SPEED_OF_LIGHT * (((times[0] - times[2]) * (r[1][1] - r[0][1])) - ((times[0] - times[1]) * (r[2][1] - r[0][1]))) / denominator
+    d_y = SPEED_OF_LIGHT * (((times[0] - times[1]) * (r[2][0] - r[0][0])) - ((times[0] - times[2]) * (r[1][0] - r[0][0]))) / denominator
+    with np.errstate(invalid = "ignore"):
+        d_prime = np.array([d_x, d_y, np.sqrt(1 - np.square(d_x) - np.square(d_y))])
+    if not 0.999 <= np.linalg.norm(d_prime) < 1.0001:
+        return False, np.nan, np.nan
+
+    azimuth, zenith = direction_angles(np.linalg.inv(rotation).dot(d_prime)[np.newaxis, :])
+
+    return not np.isnan(azimuth[0]), azimuth[0], zenith[0]
+
+
+# A signal which opens in the last window of a channel must not continue into the
+# next channel, where it used to end before it began (and had no amplitude)
+def check_channel_boundary():
+    time = np.arange(50.0)
+    env_list = np.zeros((2, len(time)))
+    env_list[0, -2] = 1.0 # Only the last window of channel 0 rises
+    env_list[1, 10] = 1.0
+
+    signals = detect_signals(time, env_list, 1)
+    amplitudes = signal_amplitudes(time, env_list, signals + [[0, 40.0, 30.0]])
+    ok = (signals == [[1, 10.0, 12.0]] and reference_signals(time, env_list, 1) == [[1, 48.0, 1.0], [1, 10.0, 12.0]] and
+          signals == reference_signals_in_channel(time, env_list, 1) and amplitudes[0] == 1.0 and np.isnan(amplitudes[1]))
+    print("Channel boundary: " + ("signals stay in their channel" if ok else "FAILED, signals " + str(signals)))
+
+    return ok
+
+
+# A block of strings with too few and too many counts has the length of a fixed width
+# block, but must be rejected by the string by string fallback
+def check_decoder():
+    try:
+        decode_events([["1000 1001 1002", "2000 2001 2002 2003 2004"]], 2, 4)
+        ok = False
+    except ValueError:
+        ok = True
+    print("Decoder: " + ("strings of the wrong record length rejected" if ok else "FAILED, strings of the wrong record length decoded"))
+
+    return ok
+
+
+def angle_difference(a, b):
+    return np.abs((np.asarray(a) - np.asarray(b) + 180) % 360 - 180)
+
+
+# Compares the fast paths with the references and the fit with the injected directions.
+# Returns True if all checks pass.
+def check(conn, results, check_events, bin_range = BIN_RANGE, max_error = 2.0):
+    ok = check_channel_boundary()
+    ok &= check_decoder()
+    layout = AntennaLayout(ANTENNA_POSITIONS)
+
+    mismatched = [event_id for event_id, time_cut, envelopes, signals, groups, fits in results[:check_events]
+                  if reference_signals_in_channel(time_cut, envelopes, bin_range) != signals]
+    print("Signal intervals: " + str(min(check_events, len(results)) - len(mismatched)) + " of " +
+          str(min(check_events, len(results))) + " events identical to the reference")
+    ok &= len(mismatched) == 0
+
+    triples = [triple for event_id, time_cut, envelopes, signals, groups, fits in results for group in groups
+               for triple in collect_triples(group.signals)]
+    if len(triples) != 0:
+        fast = layout.reconstruct([layout.triple(*antennas) for polarity, antennas, times in triples],
+                                  [times for polarity, antennas, times in triples])
+        reference = np.array([reference_direction(ANTENNA_POSITIONS[list(antennas)], times)
+                              for polarity, antennas, times in triples]).T
+        same = (fast[0] == reference[0].astype(bool)) & (~fast[0] | (np.isclose(fast[1], reference[1], atol = 1e-9) &
+                                                                    np.isclose(fast[2], reference[2], atol = 1e-9)))
+        print("Triple directions: " + str(int(same.sum())) + " of " + str(len(same)) + " identical to the reference")
+        ok &= bool(same.all())
+
+    truth = {row["event_id"]: row for row in load_truth(conn)}
+    errors = []
+    for event_id, time_cut, envelopes, signals, groups, fits in results:
+        if event_id not in truth or not truth[event_id]["pulse"]:
+            continue
+        for reconstructed, azimuth, zenith, rms, residuals in fits:
+            for p in range(len(POLARITIES)):
+                if reconstructed[p]:
+                    errors.append((angle_difference(azimuth[p], truth[event_id]["azimuth"]),
+                                   abs(zenith[p] - truth[event_id]["zenith"]), truth[event_id]["zenith"]))
+    if len(errors) != 0:
+        errors = np.array(errors)
+        # The azimuth is not defined near the zenith
+        azimuth_errors = errors[errors[:, 2] > 10, 0]
+        median_zenith = np.median(errors[:, 1])
+        median_azimuth = np.median(azimuth_errors) if len(azimuth_errors) != 0 else 0.0
+        print("Plane wave fit: median error {:.2f} degrees in zenith, {:.2f} degrees in azimuth ({} fits)".format(
+            median_zenith, median_azimuth, len(errors)))
+        ok &= median_zenith < max_error and median_azimuth < max_error
+    else:
+        print("Plane wave fit: no reconstructed pulses")
+        ok = False
+
+    print("Check " + ("passed" if ok else "FAILED"))
+
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Time the analysis stages on a synthetic WaveDump database.")
+    parser.add_argument("-db", type = str, default = None, help = "database written by synthetic_wavedump.py (default: generate one)")
+    parser.add_argument("-events", type = int, default = 500, help = "number of events to generate")
+    parser.add_argument("-length", type = int, default = 4200, help = "record length of the generated events")
+    parser.add_argument("-bin", type = int, default = BIN_RANGE, help = "bin range")
+    parser.add_argument("-envelope", type = str, default = SPLINE, choices = ENVELOPE_MODES, help = "envelope mode")
+    parser.add_argument("-fft-length", type = str, default = spectral.TRIM, choices = spectral.FFT_LENGTH_MODES, dest = "fft_length",
+                        help = "trim the records to a power of two or zero-pad them to a fast FFT length")
+    parser.add_argument("--check", action = "store_true", help = "compare the fast paths with the reference implementations")
+    parser.add_argument("-check-events", type = int, default = 50, dest = "check_events",
+                        help = "events compared with the (slow) reference signal search")
+    args = parser.parse_args()
+
+    temp_dir = None
+    db_file = args.db
+    if db_file is None:
+        temp_dir = tempfile.TemporaryDirectory()
+        db_file = os.path.join(temp_dir.name, "synthetic.db")
+        start = clock.perf_counter()
+        generate(db_file, args.events, args.length)
+        print("Generated " + str(args.events) + " events in {:.1f} s".format(clock.perf_counter() - start))
+
+    conn = connect_readonly(db_file)
+    index_samples(conn, db_file)
+    timer, events, results = run_stages(conn, args.bin, args.envelope, fft_length = args.fft_length)
+    report(timer, events)
+
+    passed = True
+    if args.check:
+        passed = check(conn, results, args.check_events, args.bin)
+
+    conn.close()
+    if temp_dir is not None:
+        temp_dir.cleanup()
+
+    raise SystemExit(0 if passed else 1)
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+# Conversion of raw digitizer ADC counts to mV.
+# The calibration is built once per run and converts a whole (channels, samples)
+# or (events, channels, samples) block with one broadcast operation.
+
+import numpy as np
+
+from wavedump_db import read_channels, read_dc_offsets
+
+
+ADC_BITS = 14 # Resolution of the digitizer
+DC_OFFSET_RANGE = 65536.0 # Full scale of the DC offset DAC in settings_dcoffsets
+
+ADC_GAIN = 0.0311 # mV per ADC count
+CHANNEL_OFFSETS = [2.17, 2.15, 2.66, 2.04, 2.23, 2.15, 2.29, 2.15] # Measured offset in mV. The index corresponds to the channel.
+DEFAULT_CHANNEL_OFFSET = 0.0 # Used for channels without a measured offset
+
+
+class Calibration(object):
+
+    # dc_offsets are the raw DAC values of settings_dcoffsets, one per recorded channel.
+    # channels are the digitizer channel numbers of the rows of the ADC blocks, by default
+    # 0, 1, ... gains and offsets default to the measured values of the 8 channel digitizer.
+    def __init__(self, dc_offsets, gains = None, offsets = None, channels = None):
+        number_of_channels = len(dc_offsets)
+        if channels is None:
+            channels = range(number_of_channels)
+
+        if gains is None:
+            gains = [ADC_GAIN] * number_of_channels
+        if offsets is None:
+            offsets = [CHANNEL_OFFSETS[i] if i < len(CHANNEL_OFFSETS) else DEFAULT_CHANNEL_OFFSET
+                       for i in channels]
+
+        if len(channels) != number_of_channels or len(gains) != number_of_channels or len(offsets) != number_of_channels:
+            raise ValueError("Calibration needs one gain and one offset per channel (" + str(number_of_channels) + " channels)")
+
+        # DC offset of each channel in ADC counts
+        self.dc_offsets = np.trunc((2**ADC_BITS - 1) * (np.asarray(dc_offsets, dtype = np.float64) / DC_OFFSET_RANGE))
+        self.gains = np.asarray(gains, dtype = np.float64)
+        self.offsets = np.asarray(offsets, dtype = np.float64)
+
+        # Column vectors broadcast over the samples axis of the ADC block
+        self._dc_offsets = self.dc_offsets[:, np.newaxis]
+        self._gains = self.gains[:, np.newaxis]
+        self._offsets = self.offsets[:, np.newaxis]
+
+    def __len__(self):
+        return len(self.gains)
+
+    # Calibration of the channels recorded in the samples table, or of the given channels
+    @classmethod
+    def from_db(cls, conn, channels = None):
+        if channels is None:
+            channels = read_channels(conn)
+
+        return cls(read_dc_offsets(conn, channels), channels = channels)
+
+    @classmethod
+    def from_store(cls, store):
+        return cls(store.dc_offsets, channels = store.channels)
+
+    # Converts ADC counts of shape (channels, samples) or (events, channels, samples) to mV
+    def to_mv(self, adc_values):
+        adc_values = np.asarray(adc_values, dtype = np.float64)
+        if adc_values.shape[-2] != len(self):
+            raise ValueError("ADC block has " + str(adc_values.shape[-2]) + " channels, calibration has " + str(len(self)))
+
+        mv_values = adc_values - self._dc_offsets
+        mv_values *= self._gains
+        mv_values += self._offsets
+
+        return mv_values
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+
+# Analyzes a whole measurement campaign as one run: every WaveDump_*.db in the
+# Measurement_* directories of the given directories, or matching the given globs,
+# with the MiniK file of its measurement. The files are analyzed by -j processes,
+# the biggest first, so that a long file does not start last. Every file gets its own
+# logs and results.db in a directory named after it in the output directory. The
+# histograms, sky maps and coincidences of all files are drawn in one set of figures,
+# and campaign.json has the statistics of every file and of the whole campaign.
+#
+# Usage: python campaign.py /path/to/databases -j 4 -output /path/to/campaign
+
+import argparse
+import glob
+import json
+import logging
+import multiprocessing
+import os
+import re
+import signal
+from time import perf_counter
+
+import matplotlib.pyplot as plt
+
+import analyze_event
+import processSQL
+import profiling
+import read_minik
+import spectral
+from analyze_event import event_logger, file_formatter, render_results, save_figures, set_verbosity, LOG_VERBOSITY
+from coincidence import COINCIDENCE_WINDOW
+from envelope import SPLINE, ENVELOPE_MODES
+from frequencyCut import FILTER_CONFIGS, DEFAULT_FILTER
+from results_db import ResultsWriter, RESULTS_NAME
+from run_results import RunResults
+from wavedump_db import index_samples, INDEX_MODES
+
+
+DATABASE_PATTERN = "WaveDump_*.db"
+MINIK_PATTERN = "minik_*.txt"
+MEASUREMENT_PATTERN = "Measurement_*"
+CAMPAIGN_NAME = "campaign.json"
+
+# Log file of each logger in the directory of a file
+LOG_FILES = {"event_logger": "events.log", "coincidence_logger": "coincidences.log", "cosmic_ray_logger": "cosmic.log"}
+
+
+# Date (YYYYMMDD) in the name of a WaveDump or MiniK file, or None
+def file_date(path):
+    match = re.search(r"_(\d{8})", os.path.basename(path))
+
+    return match.group(1) if match else None
+
+
+# WaveDump databases in the Measurement_* directories of a directory (or in the
+# directory itself), or matching a glob
+def find_databases(paths):
+    databases = set()
+    for path in paths:
+        if os.path.isdir(path):
+            found = glob.glob(os.path.join(path, MEASUREMENT_PATTERN, DATABASE_PATTERN)) + glob.glob(os.path.join(path, DATABASE_PATTERN))
+        else:
+            found = glob.glob(path)
+        databases.update(os.path.abspath(database) for database in found)
+
+    return sorted(databases)
+
+
+# MiniK file of a database: the one in its measurement directory, otherwise the latest
+# one of the other measurements which started on or before the day of the database
+def find_minik(database):
+    date = file_date(database)
+    measurement = os.path.dirname(database)
+
+    same = sorted(glob.glob(os.path.join(measurement, MINIK_PATTERN)))
+    if len(same) != 0:
+        dated = [minik for minik in same if file_date(minik) == date]
+        return (dated + same)[0]
+
+    others = [minik for minik in glob.glob(os.path.join(os.path.dirname(measurement), MEASUREMENT_PATTERN, MINIK_PATTERN))
+              if file_date(minik) is not None and (date is None or file_date(minik) <= date)]
+    if len(others) == 0:
+        return None
+
+    return max(others, key = file_date)
+
+
+# Runs once in every worker process. The parent stops the campaign.
+def init_worker(jobs):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    analyze_event.render_plots = False
+    if jobs > 1:
+        spectral.FFT_WORKERS = 1
+
+
+# Writes the logs of this process to the log files in directory
+def redirect_logs(directory):
+    for name, log_file in LOG_FILES.items():
+        logger = logging.getLogger(name)
+        for handler in logger.handlers:
+            if isinstance(handler, logging.FileHandler):
+                handler.close()
+
+        handler = logging.FileHandler(os.path.join(directory, log_file), mode = "w")
+        handler.setFormatter(file_formatter)
+        logger.handlers = [handler]
+
+
+# Directory of the logs and results of a database in the output directory
+def file_directory(output, database):
+    return os.path.join(output, os.path.splitext(os.path.basename(database))[0])
+
+
+# Analyzes all events of one database in a worker process. Returns the statistics of
+# the file, the summary of its RunResults and its StageProfile.
+def analyze_file(task):
+    database, minik, args = task
+    directory = file_directory(args.OUTPUT, database)
+    os.makedirs(directory, exist_ok = True)
+    redirect_logs(directory)
+
+    read_minik.minik_file = minik
+    read_minik.minik_index = None
+    analyze_event.run_results = RunResults()
+    profiling.profile = profiling.StageProfile()
+
+    stats = {"file": database, "minik": minik, "bytes": os.path.getsize(database)}
+    start = perf_counter()
+    try:
+        processSQL.open_database(database)
+        index_samples(processSQL.conn, database, args.INDEX)
+        run_args = argparse.Namespace(**vars(args))
+        run_args.SEARCH_MIN = 0
+        run_args.SEARCH_MAX = processSQL.NUMBER_OF_EVENTS
+        run_args.CHECKPOINT = None
+
+        event_logger.info("Input file: " + database)
+        event_logger.info("MiniK file: " + str(minik))
+        event_logger.info("Number of events: " + str(processSQL.NUMBER_OF_EVENTS) + "\n")
+        if minik is None:
+            event_logger.warning("No MiniK file found for " + os.path.basename(database))
+
+        processSQL.results_writer = ResultsWriter(os.path.join(directory, RESULTS_NAME))
+        processSQL.search_events(run_args)
+        processSQL.save_progress(run_args)
+
+    except Exception as e:
+        event_logger.error("ERROR")
+        event_logger.error(e)
+        stats["error"] = str(e)
+
+    finally:
+        if processSQL.results_writer is not None:
+            processSQL.results_writer.close()
+            processSQL.results_writer = None
+        if processSQL.conn is not None:
+            processSQL.conn.close()
+            processSQL.conn = None
+
+    results = analyze_event.run_results
+    stats["seconds"] = perf_counter() - start
+    stats.update(run_statistics(results, stats["seconds"]))
+
+    return stats, results.summary(), profiling.profile
+
+
+def run_statistics(results, seconds):
+    return {"events": results.events_analyzed,
+            "coincidence_events": results.coincidence_events,
+            "pulses": results.pulse_count,
+            "coincidences": results.coincidence_count,
+            "reconstructions": results.direction_count,
+            "events_per_second": results.events_analyzed / seconds if seconds > 0 else 0.0}
+
+
+# Sums the statistics of the files of the campaign
+def campaign_statistics(file_stats, wall_time):
+    total = {"files": len(file_stats), "failed": sum(1 for stats in file_stats if "error" in stats), "wall_time": wall_time}
+    for name in ["bytes", "events", "coincidence_events", "pulses", "coincidences", "reconstructions", "seconds"]:
+        total[name] = sum(stats[name] for stats in file_stats)
+    total["events_per_second"] = total["events"] / wall_time if wall_time > 0 else 0.0
+
+    return total
+
+
+def statistics_table(file_stats, total):
+    lines = ["{:<36}{:>10}{:>10}{:>10}{:>10}{:>10}{:>10}".format("file", "MB", "events", "coinc.", "reconst.", "seconds", "events/s")]
+    for stats in file_stats + [dict(total, file = "total", seconds = total["wall_time"])]:
+        lines.append("{:<36}{:>10.1f}{:>10}{:>10}{:>10}{:>10.1f}{:>10.2f}".format(
+            os.path.basename(stats["file"]), stats["bytes"] / 1e6, stats["events"], stats["coincidences"], stats["reconstructions"],
+            stats["seconds"], stats["events_per_second"]) + ("  ERROR: " + stats["error"] if "error" in stats else ""))
+
+    return lines
+
+
+# Analyzes the databases with args.JOBS processes and combines their results
+def run_campaign(databases, args):
+    tasks = [(database, find_minik(database), args) for database in sorted(databases, key = os.path.getsize, reverse = True)]
+    for database, minik, _ in tasks:
+        event_logger.info("    " + os.path.basename(database) + " with MiniK file " + (os.path.basename(minik) if minik else "(none)"))
+
+    combined = RunResults()
+    total_profile = profiling.StageProfile()
+    file_stats = []
+
+    pool = multiprocessing.get_context("fork").Pool(args.JOBS, initializer = init_worker, initargs = (args.JOBS,))
+    try:
+        for stats, results, profile in pool.imap_unordered(analyze_file, tasks):
+            event_logger.info("Analyzed " + os.path.basename(stats["file"]) + ": " + str(stats["events"]) + " events, " +
+                              str(stats["coincidences"]) + " coincidences, " + str(stats["reconstructions"]) +
+                              " reconstructions in {:.1f} s".format(stats["seconds"]) +
+                              (" (ERROR: " + stats["error"] + ")" if "error" in stats else ""))
+            try:
+                combined.merge(results)
+            except ValueError as e:
+                # Other record length or post trigger than the files before
+                event_logger.warning("Leaving the histogram of " + os.path.basename(stats["file"]) +
+                                     " out of the combined histogram: " + str(e))
+                results.histogram = None
+                combined.merge(results)
+            total_profile.merge(profile)
+            file_stats.append(stats)
+        pool.close()
+
+    except KeyboardInterrupt:
+        event_logger.info("Keyboard Interrupt. The report only has the " + str(len(file_stats)) + " files analyzed so far\n")
+
+    finally:
+        pool.terminate()
+        pool.join()
+
+    return sorted(file_stats, key = lambda stats: stats["file"]), combined, total_profile
+
+
+# Writes campaign.json and the combined figures to args.OUTPUT
+def write_report(args, file_stats, combined, total_profile, wall_time):
+    total = campaign_statistics(file_stats, wall_time)
+
+    for line in statistics_table(file_stats, total):
+        event_logger.info("    " + line)
+    event_logger.info("Profile of the campaign (summed over the processes):")
+    for line in total_profile.table(wall_time):
+        event_logger.info("    " + line)
+
+    report = {"settings": processSQL.analysis_settings(args),
+              "total": total, "files": file_stats, "profile": total_profile.summary(wall_time)}
+    with open(os.path.join(args.OUTPUT, CAMPAIGN_NAME), "w") as f:
+        json.dump(report, f, indent = 2)
+
+    if combined.events_analyzed != 0:
+        analyze_event.plot_file = os.path.join(args.OUTPUT, "")
+        render_results(combined, args.BIN_RANGE)
+        save_figures()
+
+    event_logger.info("Campaign report and figures written to \"" + args.OUTPUT + "\"\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Analyze the WaveDump databases of a measurement campaign as one run.")
+    parser.add_argument("paths", nargs = "+",
+                        help = "directories with Measurement_*/WaveDump_*.db files, or globs of WaveDump databases")
+    parser.add_argument("-output", type = str, dest = "OUTPUT", default = analyze_event.plot_file + "campaign",
+                        help = "directory for the combined report and the logs and results of every file")
+    parser.add_argument("-j", type = int, dest = "JOBS", default = multiprocessing.cpu_count(),
+                        help = "number of files analyzed at the same time")
+    parser.add_argument("-bin", type = int, dest = "BIN_RANGE", default = 20, help = "integer value for the bin range")
+    parser.add_argument("-filter", type = str, dest = "FILTER", default = DEFAULT_FILTER, choices = sorted(FILTER_CONFIGS),
+                        help = "frequency filter configuration defined in frequencyCut.py")
+    parser.add_argument("-envelope", type = str, dest = "ENVELOPE", default = SPLINE, choices = ENVELOPE_MODES,
+                        help = "envelope of the filtered waveforms: peak spline or analytic signal (hilbert)")
+    parser.add_argument("-fft-length", type = str, dest = "FFT_LENGTH", default = spectral.TRIM, choices = spectral.FFT_LENGTH_MODES,
+                        help = "trim the records to a power of two or zero-pad them to a fast FFT length, see processSQL.py -fft-length")
+    parser.add_argument("-window", type = float, dest = "WINDOW", default = COINCIDENCE_WINDOW, help = "coincidence window in ns")
+    parser.add_argument("-mult", type = int, dest = "MULTIPLICITY", default = None,
+                        help = "minimum number of coinciding channels (default: half of the channels)")
+    parser.add_argument("-index", type = str, dest = "INDEX", default = "auto", choices = INDEX_MODES,
+                        help = "index on samples(event_id, channel), see processSQL.py -index")
+    parser.add_argument("-verbosity", type = str, dest = "VERBOSITY", default = "summary", choices = sorted(LOG_VERBOSITY),
+                        help = "event logs of the files with the lines of every channel (detail) or the event summaries only (summary)")
+    args = parser.parse_args()
+    set_verbosity(args.VERBOSITY)
+    plt.switch_backend("Agg")
+
+    databases = find_databases(args.paths)
+    if len(databases) == 0:
+        event_logger.error("No WaveDump databases found in " + ", ".join(args.paths) + ". Exitting...")
+        raise SystemExit(1)
+
+    os.makedirs(args.OUTPUT, exist_ok = True)
+    event_logger.info("Campaign of " + str(len(databases)) + " databases with " + str(args.JOBS) + " processes:")
+
+    start = perf_counter()
+    file_stats, combined, total_profile = run_campaign(databases, args)
+    write_report(args, file_stats, combined, total_profile, perf_counter() - start)
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+
+# Checkpoints of an analysis run, so that an interrupted run or a database which has
+# grown since the last run can be continued with processSQL.py --resume.
+# A checkpoint holds the accumulated RunResults up to the last completely analyzed
+# event (its next_row and last_event_id, the totals, histogram and sky map) and the
+# settings which change the results, including the input file. The per event rows are
+# in the results file and the waveforms are not kept, so a checkpoint has the same
+# size after ten or a million events. It is written to a temporary file first and
+# then renamed, so a crash while writing leaves the previous checkpoint intact.
+
+import os
+import pickle
+
+
+CHECKPOINT_NAME = "checkpoint.pkl"
+CHECKPOINT_VERSION = 5
+CHECKPOINT_INTERVAL = 256 # Events analyzed between two checkpoints
+
+
+def save_checkpoint(path, settings, results):
+    checkpoint = {"version": CHECKPOINT_VERSION, "settings": settings, "results": results.accumulated()}
+
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as f:
+        pickle.dump(checkpoint, f, protocol = pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+# Returns the checkpoint dict, or None if there is no checkpoint at path
+def load_checkpoint(path):
+    if not os.path.exists(path):
+        return None
+
+    with open(path, "rb") as f:
+        checkpoint = pickle.load(f)
+
+    if checkpoint.get("version") != CHECKPOINT_VERSION:
+        raise ValueError("Checkpoint " + path + " has version " + str(checkpoint.get("version")) + ", expected " + str(CHECKPOINT_VERSION))
+
+    return checkpoint
+
+
+# Names of the settings which differ between a checkpoint and the current run
+def changed_settings(checkpoint, settings):
+    return sorted(name for name in set(settings) | set(checkpoint["settings"])
+                  if settings.get(name) != checkpoint["settings"].get(name))
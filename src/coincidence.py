@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+
+# Coincidence search over the signals of one event.
+# The signals are swept once in order of their onset with two pointers: the window
+# [begin, begin + window) of each signal is extended as far as it reaches, and a
+# group is accepted when at least multiplicity different channels begin inside it.
+# Accepted groups consume their signals, so every signal belongs to at most one group.
+
+import numpy as np
+from collections import namedtuple
+
+
+COINCIDENCE_WINDOW = 500 # Largest onset difference inside a coincidence in ns
+
+# channels: sorted channel numbers, begin/end: first onset and last signal end in ns,
+# signals: [channel, begin, end] of the first signal of each channel, ordered by onset
+Coincidence = namedtuple("Coincidence", ["channels", "begin", "end", "signals"])
+
+
+# At least half of the channels have to see a signal
+def default_multiplicity(number_of_channels):
+    return int(np.ceil(0.5 * number_of_channels))
+
+
+# Returns one Coincidence per group of signals in which at least multiplicity of the
+# number_of_channels channels begin within window ns of the first signal.
+def find_coincidences(signal_list, number_of_channels, multiplicity = None, window = COINCIDENCE_WINDOW):
+    if multiplicity is None:
+        multiplicity = default_multiplicity(number_of_channels)
+    if len(signal_list) == 0:
+        return []
+
+    signals = np.asarray(signal_list, dtype = np.float64).reshape(-1, 3)
+    order = np.argsort(signals[:, 1], kind = "stable")
+    channels = signals[order, 0].astype(np.int64)
+    begins = signals[order, 1]
+    ends = signals[order, 2]
+    count = len(order)
+
+    # First signal outside the window of each signal
+    stops = np.searchsorted(begins, begins + window, side = "left")
+
+    # Number of different channels inside each window, updated as both pointers move forward
+    channel_counts = np.zeros(max(number_of_channels, channels.max() + 1), dtype = np.int64)
+    distinct = np.zeros(count, dtype = np.int64)
+    stop = 0
+    present = 0
+    for i in range(count):
+        while stop < stops[i]:
+            if channel_counts[channels[stop]] == 0:
+                present += 1
+            channel_counts[channels[stop]] += 1
+            stop += 1
+        distinct[i] = present
+
+        channel_counts[channels[i]] -= 1
+        if channel_counts[channels[i]] == 0:
+            present -= 1
+
+    coincidences = []
+    i = 0
+    while i < count:
+        if distinct[i] < multiplicity:
+            i += 1
+            continue
+
+        members = []
+        seen = set()
+        for j in range(i, stops[i]):
+            if channels[j] not in seen:
+                seen.add(channels[j])
+                members.append(j)
+
+        coincidences.append(Coincidence(sorted(int(channels[j]) for j in members), begins[i], ends[i : stops[i]].max(),
+                                        [[int(channels[j]), begins[j], ends[j]] for j in members]))
+        i = stops[i]
+
+    return coincidences
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+# Envelopes of (channels, samples) waveform blocks.
+# SPLINE connects the local maxima of each channel with a cubic spline (the
+# method of create_and_plot_envelope), HILBERT takes the magnitude of the
+# analytic signal. Neither mode plots anything.
+
+import numpy as np
+from scipy.interpolate import interp1d
+from scipy.signal import hilbert
+
+
+SPLINE = "spline"
+HILBERT = "hilbert"
+ENVELOPE_MODES = [SPLINE, HILBERT]
+
+
+# Upper envelope through the local maxima of each channel.
+# The first and last sample are always used as knots so that the spline covers the whole trace.
+# Retrieved from https://stackoverflow.com/questions/34235530/python-how-to-get-high-and-low-envelope-of-a-signal
+def spline_envelope(block):
+    block = np.real(np.atleast_2d(block))
+    n = block.shape[-1]
+    samples = np.arange(n)
+
+    # Local maxima of all channels at once
+    is_peak = np.zeros(block.shape, dtype = bool)
+    is_peak[..., 1:-1] = (block[..., 1:-1] > block[..., :-2]) & (block[..., 1:-1] > block[..., 2:])
+    is_peak[..., 0] = True
+    is_peak[..., -1] = True
+
+    env = np.zeros(block.shape)
+    for channel in np.ndindex(block.shape[:-1]):
+        knots = np.flatnonzero(is_peak[channel])
+        spline = interp1d(knots, block[channel][knots], kind = "cubic", bounds_error = False, fill_value = 0.0)
+        env[channel] = spline(samples)
+
+    return env
+
+
+# Magnitude of the analytic signal of each channel
+def hilbert_envelope(block):
+    return np.abs(hilbert(np.real(np.atleast_2d(block)), axis = -1))
+
+
+def create_envelopes(block, mode = SPLINE):
+    if mode == SPLINE:
+        return spline_envelope(block)
+    elif mode == HILBERT:
+        return hilbert_envelope(block)
+
+    raise ValueError("Unknown envelope mode " + str(mode) + ", use one of " + str(ENVELOPE_MODES))
+
+
+# Time and amplitude of the maximum of each envelope
+def find_peaks(time, env):
+    index = np.argmax(env, axis = -1) # First index of the peak amplitude
+    peak_times = np.asarray(time)[index]
+    peak_amplitudes = np.take_along_axis(env, index[..., np.newaxis], axis = -1)[..., 0]
+
+    return peak_times, peak_amplitudes
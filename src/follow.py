@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+# Live tail of a WaveDump database which is still written by the acquisition.
+# A polling thread reads the new events by id through its own read-only connection
+# and puts them in chunks on a bounded queue. When the analysis falls behind by
+# queue_size chunks the polling waits, and the rest of the backlog stays in the
+# database. The latency of every event is measured from the poll which read it.
+
+import logging
+import queue
+import threading
+import time
+
+from wavedump_db import connect_readonly, index_samples, events_after, count_events_after, EVENT_CHUNK_SIZE
+
+
+POLL_INTERVAL = 1.0 # Seconds between two polls of an idle database
+QUEUE_SIZE = 4 # Chunks read ahead of the analysis
+
+
+class EventFollower(object):
+
+    # Follows the events with an id above after_id. Events are only passed on once
+    # all number_of_channels samples rows have been written. index is the mode of
+    # wavedump_db.index_samples.
+    def __init__(self, db_file, after_id, number_of_channels, chunk_size = EVENT_CHUNK_SIZE,
+                 poll_interval = POLL_INTERVAL, queue_size = QUEUE_SIZE, index = "auto"):
+        self.db_file = db_file
+        self.index = index
+        self.after_id = after_id
+        self.number_of_channels = number_of_channels
+        self.chunk_size = chunk_size
+        self.poll_interval = poll_interval
+
+        self.queue = queue.Queue(maxsize = queue_size)
+        self.lock = threading.Lock()
+        self.detected = {} # Time each read but not yet analyzed event was read
+        self.unread = 0 # Events in the database which have not been read yet
+        self.error = None
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target = self.poll, name = "follow", daemon = True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+
+    def poll(self):
+        try:
+            conn = connect_readonly(self.db_file)
+            while not self.stopped.is_set():
+                # A sidecar index is brought up to date with the rows written since the last poll
+                index_samples(conn, self.db_file, self.index)
+                chunk = self.complete_events(events_after(conn, self.after_id, self.chunk_size))
+                if len(chunk) != 0:
+                    now = time.time()
+                    with self.lock:
+                        for event_id, _, _ in chunk:
+                            self.detected[event_id] = now
+                    self.after_id = chunk[-1][0]
+                    self.put(chunk)
+
+                with self.lock:
+                    self.unread = count_events_after(conn, self.after_id)
+
+                # A full chunk means more events are waiting
+                if len(chunk) < self.chunk_size:
+                    self.stopped.wait(self.poll_interval)
+
+            conn.close()
+
+        except Exception as e:
+            self.error = e
+
+    # Drops the events at the end of the chunk whose samples are still being written.
+    # An incomplete event followed by a complete one will not be completed and is skipped.
+    def complete_events(self, chunk):
+        complete = [len(samples) == self.number_of_channels for _, _, samples in chunk]
+        if False not in complete:
+            return chunk
+
+        last = len(complete) - complete[::-1].index(True) if True in complete else 0
+        for (event_id, _, samples), ok in zip(chunk[:last], complete):
+            if not ok:
+                logging.getLogger("event_logger").warning("Skipping event id " + str(event_id) + " with " + str(len(samples)) +
+                                                          " of " + str(self.number_of_channels) + " channels")
+
+        return [event for event, ok in zip(chunk[:last], complete) if ok]
+
+    # Waits for room in the queue unless the follower is stopped
+    def put(self, chunk):
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(chunk, timeout = self.poll_interval)
+                return
+            except queue.Full:
+                continue
+
+    # Yields the chunks of new events in order until should_stop returns True
+    def chunks(self, should_stop):
+        try:
+            while not should_stop():
+                if self.error is not None:
+                    raise self.error
+                try:
+                    yield self.queue.get(timeout = self.poll_interval)
+                except queue.Empty:
+                    continue
+        finally:
+            self.stop()
+
+    # Returns the latency in seconds and the number of events still waiting after event_id was analyzed
+    def finish_event(self, event_id):
+        with self.lock:
+            detected = self.detected.pop(event_id, None)
+            backlog = len(self.detected) + self.unread
+
+        latency = time.time() - detected if detected is not None else float("nan")
+
+        return latency, backlog
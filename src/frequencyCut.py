@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+# Frequency domain filters for the antenna waveforms.
+# A filter configuration is a list of band-pass, band-stop and notch filters whose
+# responses are multiplied. A FilterBank compiles several configurations into one
+# (configurations, N // 2 + 1) response array per (N, sampling frequency), so all of
+# them are applied to a batched rfft spectrum with a single multiply.
+
+import numpy as np
+import spectral
+
+
+# Keeps the frequencies between low and high (MHz)
+class BandPass(object):
+
+    def __init__(self, low, high):
+        if low >= high:
+            raise ValueError("BandPass needs low < high, got " + str(low) + " and " + str(high) + " MHz")
+        self.low = low
+        self.high = high
+
+    def response(self, freq):
+        return ((np.abs(freq) >= self.low) & (np.abs(freq) <= self.high)).astype(np.float64)
+
+    def __repr__(self):
+        return "BandPass({:g}, {:g})".format(self.low, self.high)
+
+
+# Removes the frequencies between low and high (MHz)
+class BandStop(BandPass):
+
+    def response(self, freq):
+        return 1.0 - BandPass.response(self, freq)
+
+    def __repr__(self):
+        return "BandStop({:g}, {:g})".format(self.low, self.high)
+
+
+# Removes a narrow line of the given width around center (MHz), e.g. a known RFI carrier
+class Notch(BandStop):
+
+    def __init__(self, center, width = 1.0):
+        BandStop.__init__(self, center - width / 2.0, center + width / 2.0)
+        self.center = center
+        self.width = width
+
+    def __repr__(self):
+        return "Notch({:g}, {:g})".format(self.center, self.width)
+
+
+# Named filter configurations selectable with -filter in processSQL.py
+FILTER_CONFIGS = {
+    "none": [],
+    "cosmic": [BandPass(30, 80)], # Band used for the cosmic ray search
+}
+DEFAULT_FILTER = "cosmic"
+
+
+# Frequency response of a list of filters
+def compile_filters(filters, freq):
+    response = np.ones(len(freq))
+    for band in filters:
+        response *= band.response(freq)
+
+    return response
+
+
+class FilterBank(object):
+
+    # configs is a list of (name, filters) pairs
+    def __init__(self, configs):
+        self.names = [name for name, _ in configs]
+        self.configs = [filters for _, filters in configs]
+        self._responses = {} # Compiled responses per (N, sampling frequency)
+
+    @classmethod
+    def from_names(cls, names):
+        return cls([(name, FILTER_CONFIGS[name]) for name in names])
+
+    def __len__(self):
+        return len(self.configs)
+
+    # Responses of all configurations for an rfft of length n, shape (configurations, n // 2 + 1)
+    def response(self, n, sampling_freq):
+        key = (n, sampling_freq)
+        if key not in self._responses:
+            freq = spectral.frequency_axis(n, sampling_freq)
+            response = np.array([compile_filters(filters, freq) for filters in self.configs]).reshape(len(self), len(freq))
+            response.setflags(write = False)
+            self._responses[key] = response
+
+        return self._responses[key]
+
+    # Applies every configuration to a (..., n // 2 + 1) spectrum block.
+    # The result has shape (configurations, ...).
+    def apply(self, spectrum, n, sampling_freq):
+        response = self.response(n, sampling_freq)
+        spectrum = np.asarray(spectrum)
+
+        return spectrum[np.newaxis] * response.reshape((len(self),) + (1,) * (spectrum.ndim - 1) + (response.shape[-1],))
+
+
+# Applies the default filter to a single spectrum with its frequency axis in MHz.
+# Kept for scripts which still filter one channel at a time.
+def fourierCut(fourier, freq):
+    return fourier * compile_filters(FILTER_CONFIGS[DEFAULT_FILTER], np.asarray(freq))
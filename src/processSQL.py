@@ -4,255 +4,162 @@
 import sqlite3
 import datetime
 import matplotlib as mpl
-import scipy.fftpack as sfft
 from time import sleep
 from analyze_event import *
 # Cutting the frequencies is done in the frequencyCut.py
-from frequencyCut import fourierCut
+from frequencyCut import FilterBank, FILTER_CONFIGS, DEFAULT_FILTER
+from waveform_store import open_store
+from sample_decoder import decode_events
+from wavedump_db import (count_events, iter_event_chunks, event_position, connect_readonly, read_settings, read_channels,
+                         index_samples, INDEX_MODES)
+import spectral
+from calibration import Calibration
+from coincidence import default_multiplicity
+from run_results import RunResults
+from follow import EventFollower, POLL_INTERVAL, QUEUE_SIZE
+from results_db import ResultsWriter, RESULTS_NAME
+from checkpoint import save_checkpoint, load_checkpoint, changed_settings, CHECKPOINT_NAME, CHECKPOINT_INTERVAL
+import analyze_event
+import profiling
+import multiprocessing
+import signal
+import cProfile
+import pstats
+import glob
+import os
+from time import perf_counter
 
 
-k = 1 / 12.57
+'''
+if len(sys.argv) == 1:
+    fileLoc = input_file
+else:
+    fileLoc = sys.argv[1]
+'''
 
+conn = None # Connection to the analyzed database, opened by open_database
 
-def convertCh0(adcValue):
-    return 0.0311 * adcValue + 2.17
 
+# Opens the WaveDump database at path read-only and reads the settings of the acquisition.
+# processSQL.py analyzes input_file, campaign.py opens one database after another.
+def open_database(path):
+    global fileLoc, input_file, conn, c, s, ss, samplingFreq, samplingStepTime, recordLength, postTrigger, NUMBER_OF_EVENTS, rowSettings, calibration, NUMBER_OF_CHANNELS
 
-def convertCh1(adcValue):
-    return 0.0311 * adcValue + 2.15
+    fileLoc = input_file = path
+    conn = connect_readonly(fileLoc)
+    print("\nConnection established\n")
 
+    c = conn.cursor()
+    s = conn.cursor()
+    ss = conn.cursor()
 
-def convertCh2(adcValue):
-    return 0.0311 * adcValue + 2.66
+    # Get sampling frequency, record length and post trigger
+    samplingFreq, recordLength, postTrigger = read_settings(conn)
+    samplingStepTime = 1 / samplingFreq
+    # print("samplingFreq: " + str(samplingFreq) \
+    #        + ", samplingSteps: " + str(samplingStepTime) )
 
+    # Events and samples are streamed in search_events, only their number is needed here
+    NUMBER_OF_EVENTS = count_events(conn)
+    c.execute("SELECT * FROM settings_root")
+    rowSettings = c.fetchall()
 
-def convertCh3(adcValue):
-    return 0.0311 * adcValue + 2.04
+    # Finds the number of channels in the data
+    channels = read_channels(conn)
+    NUMBER_OF_CHANNELS = len(channels)
 
+    # ADC to mV conversion for the recorded channels, built from settings_dcoffsets
+    calibration = Calibration.from_db(conn, channels)
 
-def convertCh4(adcValue):
-    return 0.0311 * adcValue + 2.23
 
+# Set with -store to read the ADC values from a waveform store (see waveform_store.py)
+waveform_store = None
 
-def convertCh5(adcValue):
-    return 0.0311 * adcValue + 2.15
+# Writes the results to an SQLite file, set with -results (see results_db.py)
+results_writer = None
 
+# How the samples of an event range are looked up, set with -index (see wavedump_db.py)
+samples_index = "auto"
 
-def convertCh6(adcValue):
-    return 0.0311 * adcValue + 2.29
+# Set by the first Ctrl-C, the run then stops after the current event
+stop_requested = False
 
+# Collects the cProfile stats of the sampled events, set with -cprofile
+event_profiler = None
 
-def convertCh7(adcValue):
-    return 0.0311 * adcValue + 2.15
 
+# Decodes, calibrates and filters the events in [SEARCH_MIN, SEARCH_MAX), or the given
+# chunks of events starting at row SEARCH_MIN, one chunk at a time. All events of a chunk
+# go through the FFT as one (events, channels, N) block, then the results are yielded
+# event by event.
+def preprocess_events(args, chunks=None):
+    # Shift windows_size to negative by amount of post_trigger -
+    # percentage of windows_size to get time axis
+    binShift = int(recordLength * float(100 - postTrigger) / 100)
+    time = []
+    for i in range(recordLength):
+        time.append((i - binShift) * samplingStepTime * 10**9)
 
-'''
-if len(sys.argv) == 1:
-    fileLoc = input_file
-else:
-    fileLoc = sys.argv[1]
-'''
+    plan = spectral.fft_plan(recordLength, args.FFT_LENGTH)
+    exp = plan.exp
+    time = time[plan.trim]
 
-fileLoc = input_file
-conn = sqlite3.connect(fileLoc)
-conn.row_factory = sqlite3.Row
-print("\nConnection established\n")
+    # The response of the selected filter is compiled once and reused for every chunk
+    filter_bank = FilterBank.from_names([args.FILTER])
 
-c = conn.cursor()
-s = conn.cursor()
-ss = conn.cursor()
+    adcBuffer = None # Decoded ADC counts, reused by every chunk of the same size
+    row = args.SEARCH_MIN
+    if chunks is None:
+        chunks = iter_event_chunks(conn, args.SEARCH_MIN, args.SEARCH_MAX, with_samples=waveform_store is None)
+    for chunk in profiling.iterate("sql_fetch", chunks):
 
-# Get sampling frequency
-c.execute("SELECT frequency FROM digitizer")
-samplingFreq = c.fetchone()[0]
-samplingStepTime = 1 / samplingFreq
-# print("samplingFreq: " + str(samplingFreq) \
-#        + ", samplingSteps: " + str(samplingStepTime) )
+        # Get ADC values, either memory-mapped from a waveform store or parsed from the database
+        with profiling.profile.stage("decode"):
+            if waveform_store is not None:
+                adcBlock = np.stack([waveform_store.event(waveform_store.find(event_id)) for event_id, _, _ in chunk])
+            else:
+                adcBuffer = decode_events([adcStrings for _, _, adcStrings in chunk], NUMBER_OF_CHANNELS, recordLength, out=adcBuffer)
+                adcBlock = adcBuffer
 
-c.execute("SELECT * FROM events")
-rowEvents = c.fetchall()
-c.execute("SELECT * FROM samples")
-rowSamples = c.fetchall()
-c.execute("SELECT * FROM settings_root")
-rowSettings = c.fetchall()
-c.execute("SELECT * FROM settings_dcoffsets")
-rowDCOffsets = c.fetchall()
+        # Converts all events and channels to mV at once, shape (events, channels, samples)
+        with profiling.profile.stage("calibration"):
+            adcBlock = calibration.to_mv(adcBlock[:, :, plan.trim])
 
-# Finds the number of channels in the data
-c.execute("SELECT DISTINCT channel FROM samples")
-NUMBER_OF_CHANNELS = len(c.fetchall())
+        with profiling.profile.stage("fft_filter"):
+            freq = spectral.frequency_axis(plan.size, samplingFreq)
+            fourierBlock = plan.forward(adcBlock)
+            fourierCutBlock = filter_bank.apply(fourierBlock, plan.size, samplingFreq)[0]
+            cutBlock = plan.inverse(fourierCutBlock)
 
+        for (event_id, event_timestamp, _), adcValues, fourier, fourierCutList, cut_list in zip(chunk, adcBlock, fourierBlock, fourierCutBlock, cutBlock):
+            yield row, event_id, event_timestamp, time, exp, freq, adcValues, fourier, fourierCutList, cut_list
+            row += 1
 
-def search_events(args):
-    for row in range(args.SEARCH_MIN, args.SEARCH_MAX):
 
-        plot1.clear()
-        plot2.clear()
-        plot3.clear()
+# on_event(row, event_id) is called after each event, before its log block is closed.
+# save is False in the worker processes of -j, where the parent saves the progress.
+def search_events(args, chunks=None, on_event=None, save=True):
+    events = preprocess_events(args, chunks)
+    for row, event_id, event_timestamp, time, exp, freq, adcValues, fourier, fourierCutList, cut_list in events:
+        profiling.profile.events += 1
+
+        # Every CPROFILE-th event is analyzed under cProfile
+        sampled = event_profiler is not None and row % args.CPROFILE == 0
+        if sampled:
+            event_profiler.enable()
 
         event_logger.info("################################################")
-        event_logger.info("Analyzing Event " + str(row) + "...")
-
-        event_id = rowEvents[row]['id']
-        event_timestamp = rowEvents[row]['time_stamp']
-        settings_id = 0
-        record_length = c.execute(
-            "SELECT record_length FROM settings_root").fetchone()[0]
-        post_trigger = c.execute(
-            "SELECT post_trigger FROM settings_root").fetchone()[0]
-
-        dcOffsetCH0 = rowDCOffsets[0]['offset']
-        dcOffsetCH0 = int((2**(14) - 1) * (dcOffsetCH0 / 65536.0))
-        #event_logger.info("dcOffsetCh0: " + str(dcOffsetCH0))
-        dcOffsetCH1 = rowDCOffsets[1]['offset']
-        dcOffsetCH1 = int((2**(14) - 1) * (dcOffsetCH1 / 65536.0))
-        #event_logger.info("dcOffsetCh1: " + str(dcOffsetCH1))
-        dcOffsetCH2 = rowDCOffsets[2]['offset']
-        dcOffsetCH2 = int((2**(14) - 1) * (dcOffsetCH2 / 65536.0))
-        #event_logger.info("dcOffsetCh2: " + str(dcOffsetCH2))
-        dcOffsetCH3 = rowDCOffsets[3]['offset']
-        dcOffsetCH3 = int((2**(14) - 1) * (dcOffsetCH3 / 65536.0))
-        #event_logger.info("dcOffsetCh3: " + str(dcOffsetCH3))
-        dcOffsetCH4 = rowDCOffsets[4]['offset']
-        dcOffsetCH4 = int((2**(14) - 1) * (dcOffsetCH4 / 65536.0))
-
-        dcOffsetCH5 = rowDCOffsets[5]['offset']
-        dcOffsetCH5 = int((2**(14) - 1) * (dcOffsetCH5 / 65536.0))
-
-        dcOffsetCH6 = rowDCOffsets[6]['offset']
-        dcOffsetCH6 = int((2**(14) - 1) * (dcOffsetCH6 / 65536.0))
-
-        dcOffsetCH7 = rowDCOffsets[7]['offset']
-        dcOffsetCH7 = int((2**(14) - 1) * (dcOffsetCH7 / 65536.0))
-
-        event_logger.info("    Event Timestamp (sec): " + str(event_timestamp))
-        # event_logger.info("Event timestamp (UTC): " + time.strftime("%a, %d %b %Y %H:%M:%S", time.gmtime(event_timestamp)))
+        event_logger.info("Analyzing Event %s...", row)
 
-        # Shift windows_size to negative by amount of post_trigger -
-        # percentage of windows_size to get time axis
-        binShift = int(int(record_length) * float(100 - post_trigger) / 100)
-        time = []
-        for i in range(int(record_length)):
-            time.append((i - binShift) * samplingStepTime * 10**9)
-
-        # Get ADC values
-        c.execute("SELECT samples FROM samples WHERE event_id = " + str(event_id))
-        adcValuesCh0 = c.fetchone()[0]
-        adcValuesCh1 = c.fetchone()[0]
-        adcValuesCh2 = c.fetchone()[0]
-        adcValuesCh3 = c.fetchone()[0]
-        adcValuesCh4 = c.fetchone()[0]
-        adcValuesCh5 = c.fetchone()[0]
-        adcValuesCh6 = c.fetchone()[0]
-        adcValuesCh7 = c.fetchone()[0]
-
-        adcValuesCh0 = adcValuesCh0.split()
-        adcValuesCh0 = [convertCh0((float(i) - dcOffsetCH0)) for i in adcValuesCh0]
-
-        adcValuesCh1 = adcValuesCh1.split()
-        adcValuesCh1 = [convertCh1((float(i) - dcOffsetCH1)) for i in adcValuesCh1]
-
-        adcValuesCh2 = adcValuesCh2.split()
-        adcValuesCh2 = [convertCh2((float(i) - dcOffsetCH2)) for i in adcValuesCh2]
-
-        adcValuesCh3 = adcValuesCh3.split()
-        adcValuesCh3 = [convertCh3((float(i) - dcOffsetCH3)) for i in adcValuesCh3]
-
-        adcValuesCh4 = adcValuesCh4.split()
-        adcValuesCh4 = [convertCh4((float(i) - dcOffsetCH4)) for i in adcValuesCh4]
-
-        adcValuesCh5 = adcValuesCh5.split()
-        adcValuesCh5 = [convertCh5((float(i) - dcOffsetCH5)) for i in adcValuesCh5]
-
-        adcValuesCh6 = adcValuesCh6.split()
-        adcValuesCh6 = [convertCh6((float(i) - dcOffsetCH6)) for i in adcValuesCh6]
-
-        adcValuesCh7 = adcValuesCh7.split()
-        adcValuesCh7 = [convertCh7((float(i) - dcOffsetCH7)) for i in adcValuesCh7]
-
-        exp = np.log(len(adcValuesCh1)) / np.log(2)
-        expDif = len(adcValuesCh1) - 2 ** int(exp)
-        if expDif % 2 == 0:
-            adcValuesCh0 = adcValuesCh0[int(expDif / 2):-int(expDif / 2)]
-            adcValuesCh1 = adcValuesCh1[int(expDif / 2):-int(expDif / 2)]
-            adcValuesCh2 = adcValuesCh2[int(expDif / 2):-int(expDif / 2)]
-            adcValuesCh3 = adcValuesCh3[int(expDif / 2):-int(expDif / 2)]
-            adcValuesCh4 = adcValuesCh4[int(expDif / 2):-int(expDif / 2)]
-            adcValuesCh5 = adcValuesCh5[int(expDif / 2):-int(expDif / 2)]
-            adcValuesCh6 = adcValuesCh6[int(expDif / 2):-int(expDif / 2)]
-            adcValuesCh7 = adcValuesCh7[int(expDif / 2):-int(expDif / 2)]
-
-            time = time[int(expDif / 2):-int(expDif / 2)]
-
-        else:
-            adcValuesCh0 = adcValuesCh0[int(expDif / 2) - 1:-int(expDif / 2)]
-            adcValuesCh1 = adcValuesCh1[int(expDif / 2) - 1:-int(expDif / 2)]
-            adcValuesCh2 = adcValuesCh2[int(expDif / 2) - 1:-int(expDif / 2)]
-            adcValuesCh3 = adcValuesCh3[int(expDif / 2) - 1:-int(expDif / 2)]
-            adcValuesCh4 = adcValuesCh4[int(expDif / 2) - 1:-int(expDif / 2)]
-            adcValuesCh5 = adcValuesCh5[int(expDif / 2) - 1:-int(expDif / 2)]
-            adcValuesCh6 = adcValuesCh6[int(expDif / 2) - 1:-int(expDif / 2)]
-            adcValuesCh7 = adcValuesCh7[int(expDif / 2) - 1:-int(expDif / 2)]
-
-            time = time[int(expDif / 2) - 1:-int(expDif / 2)]
+        event_logger.info("    Event Timestamp (sec): %s", event_timestamp)
+        # event_logger.info("Event timestamp (UTC): " + time.strftime("%a, %d %b %Y %H:%M:%S", time.gmtime(event_timestamp)))
 
         # event_logger.info(len(adcValuesCh0))
-        event_logger.info("    Exp: {:6.3f}".format(exp))  # + "\n")
-
-        ch0Fourier = np.complex()
-        ch1Fourier = np.complex()
-        ch2Fourier = np.complex()
-        ch3Fourier = np.complex()
-        ch4Fourier = np.complex()
-        ch5Fourier = np.complex()
-        ch6Fourier = np.complex()
-        ch7Fourier = np.complex()
-
-        ch0Fourier = sfft.fft(adcValuesCh0, len(adcValuesCh0))
-        ch1Fourier = sfft.fft(adcValuesCh1, len(adcValuesCh1))
-        ch2Fourier = sfft.fft(adcValuesCh2, len(adcValuesCh2))
-        ch3Fourier = sfft.fft(adcValuesCh3, len(adcValuesCh3))
-        ch4Fourier = sfft.fft(adcValuesCh4, len(adcValuesCh4))
-        ch5Fourier = sfft.fft(adcValuesCh5, len(adcValuesCh5))
-        ch6Fourier = sfft.fft(adcValuesCh6, len(adcValuesCh6))
-        ch7Fourier = sfft.fft(adcValuesCh7, len(adcValuesCh7))
-
-        freq = sfft.fftfreq(len(adcValuesCh3), samplingStepTime)
-        for i in range(len(freq)):
-            freq[i] = freq[i] * 10**(-6)
-
-        ch0FourierCut = np.complex()
-        ch1FourierCut = np.complex()
-        ch2FourierCut = np.complex()
-        ch3FourierCut = np.complex()
-        ch4FourierCut = np.complex()
-        ch5FourierCut = np.complex()
-        ch6FourierCut = np.complex()
-        ch7FourierCut = np.complex()
-
-        ch0FourierCut = fourierCut(ch0Fourier, freq)
-        ch1FourierCut = fourierCut(ch1Fourier, freq)
-        ch2FourierCut = fourierCut(ch2Fourier, freq)
-        ch3FourierCut = fourierCut(ch3Fourier, freq)
-        ch4FourierCut = fourierCut(ch4Fourier, freq)
-        ch5FourierCut = fourierCut(ch5Fourier, freq)
-        ch6FourierCut = fourierCut(ch6Fourier, freq)
-        ch7FourierCut = fourierCut(ch7Fourier, freq)
-
-        adcValuesCh0Cut = sfft.ifft(ch0FourierCut, len(ch0FourierCut))
-        adcValuesCh1Cut = sfft.ifft(ch1FourierCut, len(ch1FourierCut))
-        adcValuesCh2Cut = sfft.ifft(ch2FourierCut, len(ch2FourierCut))
-        adcValuesCh3Cut = sfft.ifft(ch3FourierCut, len(ch3FourierCut))
-        adcValuesCh4Cut = sfft.ifft(ch4FourierCut, len(ch4FourierCut))
-        adcValuesCh5Cut = sfft.ifft(ch5FourierCut, len(ch5FourierCut))
-        adcValuesCh6Cut = sfft.ifft(ch6FourierCut, len(ch6FourierCut))
-        adcValuesCh7Cut = sfft.ifft(ch7FourierCut, len(ch7FourierCut))
-
-        # , adcValuesCh4Cut[x_min_index : x_max_index], adcValuesCh5Cut[x_min_index : x_max_index]] #Stores each channel in a list so that the commands can be iterated instead of hard coded.
-        cut_list = [adcValuesCh0Cut, adcValuesCh1Cut, adcValuesCh2Cut, adcValuesCh3Cut, adcValuesCh4Cut, adcValuesCh5Cut, adcValuesCh6Cut, adcValuesCh7Cut]
+        event_logger.log(DETAIL, "    Exp: %6.3f", exp)  # + "\n")
 
         coincidence = False  # Reset boolean each iteration
-        coincidence = analyze_channels(row, time, cut_list, args.BIN_RANGE, event_timestamp)
+        coincidence = analyze_channels(row, time, cut_list, args.BIN_RANGE, event_timestamp, args.ENVELOPE,
+                                       args.MULTIPLICITY, args.WINDOW)
 
         '''
         try:
@@ -268,95 +175,373 @@ def search_events(args):
 		'''
 
         if coincidence == True:
+            waveforms = {"row": row, "time": time, "freq": freq, "adcValues": adcValues, "fourier": fourier,
+                         "fourierCutList": fourierCutList, "cut_list": cut_list,
+                         "envelopes": analyze_event.last_envelopes}
+            analyze_event.run_results.set_waveforms(waveforms)
+            if analyze_event.render_plots:
+                plot_waveforms(waveforms)
+                draw_summaries(analyze_event.run_results)
+                show_figures()
+
+        if sampled:
+            event_profiler.disable()
+
+        analyze_event.run_results.finish_event(row, event_id, event_timestamp, coincidence)
+        if on_event is not None:
+            on_event(row, event_id)
+        event_logger.info("################################################\n")
 
-            plot1.plot(time, adcValuesCh0, label="CH0", color=cmap(0))
-            plot1.plot(time, adcValuesCh1, label="CH1", color=cmap(1))
-            plot1.plot(time, adcValuesCh2, label="CH2", color=cmap(2))
-            plot1.plot(time, adcValuesCh3, label="CH3", color=cmap(3))
-            plot1.plot(time, adcValuesCh4, label="CH4", color=cmap(4))
-            plot1.plot(time, adcValuesCh5, label="CH5", color=cmap(5))
-            plot1.plot(time, adcValuesCh6, label="CH6", color=cmap(6))
-            plot1.plot(time, adcValuesCh7, label="CH7", color=cmap(7))
-
-            plot1.set_xlabel("Time (ns)")
-            plot1.set_ylabel("Amplitude (mV)")
-            plot1.set_title("Recorded waveforms")
-            plot1.set_xlim(X_MIN, X_MAX)
-            plot1.legend()
-            plot1.grid(1)
-
-            plot2.plot(freq[1:int(len(ch0Fourier) / 2)], 20 * np.log10(abs(ch0Fourier)[1:int(len(ch0Fourier) / 2)]),
-                       label="Fourier Trafo CH0", lw=2, color='blue')
-            plot2.plot(freq[1:int(len(ch1Fourier) / 2)], 20 * np.log10(abs(ch1Fourier)[1:int(len(ch1Fourier) / 2)]),
-                       label="Fourier Trafo CH1", lw=2, color='red')
-            plot2.plot(freq[1:int(len(ch2Fourier) / 2)], 20 * np.log10(abs(ch2Fourier)[1:int(len(ch2Fourier) / 2)]),
-                       label="Fourier Trafo CH2", lw=2, color='green')
-            plot2.plot(freq[1:int(len(ch3Fourier) / 2)], 20 * np.log10(abs(ch3Fourier)[1:int(len(ch3Fourier) / 2)]),
-                       label="Fourier Trafo CH3", lw=2, color='orange')
-            plot2.plot(freq[1:int(len(ch0Fourier) / 2)], 20 * np.log10(abs(ch0FourierCut)[1:int(len(ch0Fourier) / 2)]),
-                       label="Fourier Trafo Cut", color='black')
-            plot2.set_xlabel("Frequency (MHz)")
-            plot2.set_ylabel("Power (dB)")
-            plot2.set_title("Fourier transformation")
-            plot2.set_ylim((0, 20 * np.log10(abs(ch0Fourier[1:]).max()) + 3))
-            plot2.legend()
-            plot2.grid(1)
-
-            plot3.plot(time, adcValuesCh0Cut, label="ch0Cut", color=cmap(0))
-            plot3.plot(time, adcValuesCh1Cut, label="ch1Cut", color=cmap(1))
-            plot3.plot(time, adcValuesCh2Cut, label="ch2Cut", color=cmap(2))
-            plot3.plot(time, adcValuesCh3Cut, label="ch3Cut", color=cmap(3))
-            plot3.plot(time, adcValuesCh4Cut, label="ch4Cut", color=cmap(4))
-            plot3.plot(time, adcValuesCh5Cut, label="ch5Cut", color=cmap(5))
-            plot3.plot(time, adcValuesCh6Cut, label="ch6Cut", color=cmap(6))
-            plot3.plot(time, adcValuesCh7Cut, label="ch7Cut", color=cmap(7))
-
-            plot3.set_xlabel("Time (ns)")
-            plot3.set_ylabel("Amplitude (mV)")
-            plot3.set_title("Waveforms with frequency cuts")
-            plot3.set_xlim(X_MIN, X_MAX)
-            plot3.grid(1)
-
-            plt.tight_layout()
-
-            fig1.canvas.draw()
-            fig1.show()
-            fig1.canvas.flush_events()
-
-            fig2.canvas.draw()
-            fig2.show()
-            fig2.canvas.flush_events()
-
-            fig3.canvas.draw()
-            fig3.show()
-            fig3.canvas.flush_events()
+        if save and (stop_requested or (row + 1 - args.SEARCH_MIN) % CHECKPOINT_INTERVAL == 0):
+            save_progress(args)
+        if stop_requested:
+            raise KeyboardInterrupt
+
+
+# Keeps the log records of a worker process so that the parent can write them in event order
+class RecordCollector(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        # Formats the message now, the arguments may not survive pickling
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        self.records.append(record)
+
+
+record_collector = None
+
+
+# Runs once in every worker process. Each worker opens its own read-only connection,
+# uses a single FFT thread and collects its log records instead of writing them.
+def init_worker():
+    global conn, c, record_collector, results_writer, event_profiler
+    conn = connect_readonly(fileLoc)
+    index_samples(conn, fileLoc, samples_index)
+    c = conn.cursor()
+
+    results_writer = None # Only the parent writes results
+    spectral.FFT_WORKERS = 1
+    signal.signal(signal.SIGINT, signal.SIG_IGN) # The parent stops the run
+    analyze_event.render_plots = False
+
+    # The parent's profiler is copied by fork, each worker keeps its own
+    if event_profiler is not None:
+        event_profiler = cProfile.Profile()
+
+    record_collector = RecordCollector()
+    for logger in [event_logger, coincidence_logger, cosmic_ray_logger]:
+        logger.handlers = [record_collector]
+
+
+# Analyzes the events in [start, stop) in a worker process
+def analyze_chunk(task):
+    start, stop, args = task
+    args = argparse.Namespace(**vars(args))
+    args.SEARCH_MIN = start
+    args.SEARCH_MAX = stop
+    args.CHECKPOINT = None # Only the parent writes checkpoints
+
+    analyze_event.run_results = RunResults()
+    profiling.profile = profiling.StageProfile()
+    record_collector.records = []
+    search_events(args, save=False)
+
+    # Stats of all chunks of this worker so far, combined by write_cprofile
+    if event_profiler is not None:
+        event_profiler.create_stats()
+        if len(event_profiler.stats) != 0:
+            event_profiler.dump_stats(args.CPROFILE_FILE + "." + str(os.getpid()))
+
+    return record_collector.records, analyze_event.run_results, profiling.profile
+
+
+# Splits the event range into chunks which are analyzed by args.JOBS processes.
+# The log records and results come back in event order, so the logs and the
+# figures are the same as in a serial run.
+def search_events_parallel(args):
+    tasks = [(start, min(start + args.CHUNK, args.SEARCH_MAX), args)
+             for start in range(args.SEARCH_MIN, args.SEARCH_MAX, args.CHUNK)]
+
+    pool = multiprocessing.get_context("fork").Pool(args.JOBS, initializer=init_worker)
+    try:
+        unsaved = 0
+        for records, results, profile in pool.imap(analyze_chunk, tasks):
+            for record in records:
+                logging.getLogger(record.name).handle(record)
+            analyze_event.run_results.merge(results)
+            profiling.profile.merge(profile)
+
+            unsaved += results.events_analyzed
+            if stop_requested or unsaved >= CHECKPOINT_INTERVAL:
+                save_progress(args)
+                unsaved = 0
+            if stop_requested:
+                raise KeyboardInterrupt
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+# Analyzes the events after row SEARCH_MIN - 1 as the acquisition writes them, until Ctrl-C
+def follow_events(args):
+    after_id = -1
+    if args.SEARCH_MIN > 0:
+        after_id = c.execute("SELECT id FROM events ORDER BY id LIMIT 1 OFFSET ?", (args.SEARCH_MIN - 1,)).fetchone()[0]
+
+    follower = EventFollower(fileLoc, after_id, NUMBER_OF_CHANNELS, args.CHUNK, args.POLL, args.QUEUE, samples_index).start()
+    latencies = []
+
+    def report_latency(row, event_id):
+        latency, backlog = follower.finish_event(event_id)
+        latencies.append(latency)
+        event_logger.info("    Latency: %.3f s, backlog: %d events", latency, backlog)
+
+        # Results are written as soon as the analysis has caught up
+        if backlog == 0 and results_writer is not None:
+            results_writer.write(analyze_event.run_results)
+
+    event_logger.info("Following " + input_file.split("/")[-1] + " after event id " + str(after_id) + "...\n")
+    try:
+        search_events(args, follower.chunks(lambda: stop_requested), report_latency)
+    finally:
+        follower.stop()
+        if len(latencies) != 0:
+            event_logger.info("Followed " + str(len(latencies)) + " events, latency mean {:.3f} s, max {:.3f} s\n".format(
+                np.nanmean(latencies), np.nanmax(latencies)))
+
+
+# The analysis options which change the results, shared by processSQL and campaign.py
+def analysis_settings(args):
+    return {"bin_range": args.BIN_RANGE, "filter": args.FILTER, "envelope": args.ENVELOPE, "window": args.WINDOW,
+            "multiplicity": args.MULTIPLICITY, "fft_length": args.FFT_LENGTH}
+
+
+# Everything which changes the results of a run. A run can only be resumed with the same settings.
+def run_settings(args):
+    settings = {"input_file": input_file, "channels": NUMBER_OF_CHANNELS}
+    settings.update(analysis_settings(args))
+    return settings
+
+
+def write_checkpoint(args):
+    save_checkpoint(args.CHECKPOINT, run_settings(args), analyze_event.run_results)
+    event_logger.info("Checkpoint saved after event " + str(analyze_event.run_results.next_row - 1) +
+                      " (id " + str(analyze_event.run_results.last_event_id) + ")")
+
+
+# Writes the new results, then the checkpoint, so the results file always has the
+# events of the checkpoint. The writer clears the rows it has stored.
+@timed("checkpoint")
+def save_progress(args):
+    if results_writer is not None:
+        results_writer.write(analyze_event.run_results)
+    if args.CHECKPOINT is not None and analyze_event.run_results.next_row is not None:
+        write_checkpoint(args)
+
+
+# Continues the run of the checkpoint at args.CHECKPOINT after its last event.
+# Returns False if the checkpoint was written with other settings.
+def resume_run(args):
+    checkpoint = load_checkpoint(args.CHECKPOINT)
+    if checkpoint is None:
+        event_logger.warning("No checkpoint found at " + args.CHECKPOINT + ", starting at event " + str(args.SEARCH_MIN))
+        return True
+
+    changed = changed_settings(checkpoint, run_settings(args))
+    if len(changed) != 0:
+        event_logger.error("Checkpoint " + args.CHECKPOINT + " was written with different settings (" + ", ".join(changed) + ")")
+        return False
+
+    analyze_event.run_results = checkpoint["results"]
+    if analyze_event.run_results.last_event_id is not None:
+        # Positions are counted in the current database, which may have grown since
+        args.SEARCH_MIN = event_position(conn, analyze_event.run_results.last_event_id)
+
+    event_logger.info("Resuming from " + args.CHECKPOINT + ": " + str(analyze_event.run_results.events_analyzed) +
+                      " events analyzed, continuing at event " + str(args.SEARCH_MIN))
+
+    # Draws the restored results into the live figures
+    if analyze_event.render_plots:
+        render_results(analyze_event.run_results, args.BIN_RANGE)
+
+    return True
+
+
+# The first Ctrl-C stops the run after the current event, so that the checkpoint is
+# complete. A second one interrupts right away.
+def request_stop(signum, frame):
+    global stop_requested
+    stop_requested = True
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    event_logger.info("Stopping after the current event, press Ctrl-C again to stop right away")
+
+
+# Draws the collected results unless they were drawn while analyzing, then saves the figures
+def write_figures(bin_range):
+    if not analyze_event.render_plots or analyze_event.fig1 is None:
+        render_results(analyze_event.run_results, bin_range)
+    save_figures()
 
-        event_logger.info("################################################\n")
+
+# Logs the stage table of the run since start and writes it to args.PROFILE as JSON
+def write_profile(args, start):
+    wall_time = perf_counter() - start
+    event_logger.info("Profile of the run:")
+    for line in profiling.profile.table(wall_time):
+        event_logger.info("    " + line)
+    if args.PROFILE is not None:
+        profiling.profile.write_json(args.PROFILE, wall_time)
+        event_logger.info("Profile written to \"" + args.PROFILE + "\"")
+
+    write_cprofile(args)
+
+
+# Saves the figures and the profile. Without an analyzed event they would only replace
+# the files of an earlier run with empty ones.
+def write_outputs(args, start):
+    if analyze_event.run_results.events_analyzed == 0:
+        event_logger.info("No events analyzed, figures and profile not written\n")
+        return
+
+    write_figures(args.BIN_RANGE)
+    event_logger.info("Figures saved to \"" + plot_file + "\"\n")
+    write_profile(args, start)
+
+
+# Combines the cProfile stats of this process and the worker processes in args.CPROFILE_FILE
+def write_cprofile(args):
+    if event_profiler is None:
+        return
+
+    # A profile without any sampled event cannot be loaded
+    parts = glob.glob(args.CPROFILE_FILE + ".*")
+    event_profiler.create_stats()
+    sources = parts + ([event_profiler] if len(event_profiler.stats) != 0 else [])
+    if len(sources) == 0:
+        event_logger.warning("No event was analyzed under cProfile")
+        return
+
+    pstats.Stats(*sources).dump_stats(args.CPROFILE_FILE)
+    for part in parts:
+        os.remove(part)
+
+    event_logger.info("cProfile stats of one in " + str(args.CPROFILE) + " events written to \"" + args.CPROFILE_FILE +
+                      "\", view them with: python -m pstats " + args.CPROFILE_FILE)
 
 
 if __name__ == "__main__":
 
+    # Set before anything can fail, the error handler writes the profile of the run
+    run_start = perf_counter()
+    open_database(input_file)
+
     try:
         # Define some constants
         parser = argparse.ArgumentParser(description="Define constants for the minimum event number, the maximum event number, and the bin range.")
         parser.add_argument("-min", type=int, dest="SEARCH_MIN", default=0,
                             help="integer value for the minimum event number")
-        parser.add_argument("-max", type=int, dest="SEARCH_MAX", default=len(rowEvents),
+        parser.add_argument("-max", type=int, dest="SEARCH_MAX", default=NUMBER_OF_EVENTS,
                             help="integer value for the maximum event number")
         parser.add_argument("-bin", type=int, dest="BIN_RANGE", default=20,
                             help="integer value for the bin range")
+        parser.add_argument("-store", type=str, dest="STORE_DIR", default=None,
+                            help="waveform store created by waveform_store.py for the input file")
+        parser.add_argument("-filter", type=str, dest="FILTER", default=DEFAULT_FILTER, choices=sorted(FILTER_CONFIGS),
+                            help="frequency filter configuration defined in frequencyCut.py")
+        parser.add_argument("-envelope", type=str, dest="ENVELOPE", default=SPLINE, choices=ENVELOPE_MODES,
+                            help="envelope of the filtered waveforms: peak spline or analytic signal (hilbert)")
+        parser.add_argument("-fft-length", type=str, dest="FFT_LENGTH", default=spectral.TRIM, choices=spectral.FFT_LENGTH_MODES,
+                            help="trim the records to the central power of two samples or keep them whole, zero-padded to a fast FFT length (pad)")
+        parser.add_argument("-window", type=float, dest="WINDOW", default=COINCIDENCE_WINDOW,
+                            help="coincidence window in ns")
+        parser.add_argument("-mult", type=int, dest="MULTIPLICITY", default=None,
+                            help="minimum number of coinciding channels (default: half of the channels)")
+        parser.add_argument("-j", type=int, dest="JOBS", default=1,
+                            help="number of processes analyzing the events")
+        parser.add_argument("-chunk", type=int, dest="CHUNK", default=64,
+                            help="number of events per task with -j")
+        parser.add_argument("-checkpoint", type=str, dest="CHECKPOINT", default=plot_file + CHECKPOINT_NAME,
+                            help="checkpoint file, written every " + str(CHECKPOINT_INTERVAL) + " events and when the run is stopped")
+        parser.add_argument("-results", type=str, dest="RESULTS", default=plot_file + RESULTS_NAME,
+                            help="SQLite file for the events, envelope peaks, pulses, coincidences and reconstructions")
+        parser.add_argument("--resume", action="store_true", dest="RESUME",
+                            help="continue after the last event of the checkpoint, e.g. after an interruption or on a grown database")
+        parser.add_argument("--follow", action="store_true", dest="FOLLOW",
+                            help="keep analyzing new events while the acquisition writes the database, until Ctrl-C")
+        parser.add_argument("-poll", type=float, dest="POLL", default=POLL_INTERVAL,
+                            help="seconds between two polls of the database with --follow")
+        parser.add_argument("-queue", type=int, dest="QUEUE", default=QUEUE_SIZE,
+                            help="chunks of events read ahead of the analysis with --follow")
+        parser.add_argument("-verbosity", type=str, dest="VERBOSITY", default="detail", choices=sorted(LOG_VERBOSITY),
+                            help="event log with the lines of every channel (detail) or the event summaries only (summary)")
+        parser.add_argument("--no-plots", action="store_true", dest="NO_PLOTS",
+                            help="batch mode: no GUI backend and no live figures, the PDFs are drawn once at the end")
+        parser.add_argument("-index", type=str, dest="INDEX", default="auto", choices=INDEX_MODES,
+                            help="index on samples(event_id, channel): the database's own or else a sidecar file (auto), "
+                                 "one added to the database (create), always a sidecar file (sidecar), or none")
+        parser.add_argument("-profile", type=str, dest="PROFILE", default=plot_file + "profile.json",
+                            help="JSON file for the time spent in each stage of the analysis")
+        parser.add_argument("-cprofile", type=int, dest="CPROFILE", default=0,
+                            help="analyze every CPROFILE-th event under cProfile (default: off)")
+        parser.add_argument("-cprofile-file", type=str, dest="CPROFILE_FILE", default=plot_file + "cprofile.pstats",
+                            help="file for the cProfile stats of the sampled events")
 
         args = parser.parse_args()
+        set_verbosity(args.VERBOSITY)
+
+        # A store which does not belong to the input file fails before anything is written
+        if args.STORE_DIR is not None:
+            try:
+                waveform_store = open_store(args.STORE_DIR, read_channels(conn), recordLength)
+            except ValueError as e:
+                event_logger.error(str(e) + ". Exitting...")
+                conn.close()
+                sys.exit(1)
+            if waveform_store.is_stale():
+                event_logger.warning("Waveform store " + args.STORE_DIR + " is older than the input file. Rerun waveform_store.py to update it.")
+
+        samples_index = args.INDEX
+        used_index = index_samples(conn, fileLoc, samples_index)
+
+        if args.CPROFILE > 0:
+            event_profiler = cProfile.Profile()
+            # Stats left behind by an interrupted run
+            for part in glob.glob(args.CPROFILE_FILE + ".*"):
+                os.remove(part)
+
+        # Figures are only drawn live in a serial run with plots. Otherwise the results
+        # are collected and drawn once by write_figures.
+        if args.NO_PLOTS:
+            plt.switch_backend("Agg")
+        analyze_event.render_plots = not args.NO_PLOTS and args.JOBS == 1
+        if analyze_event.render_plots:
+            create_figures()
+
+        if args.RESUME and not resume_run(args):
+            sys.exit()
+
+        if args.RESULTS is not None:
+            results_writer = ResultsWriter(args.RESULTS, args.SEARCH_MIN if args.RESUME else None)
+
+        # Ensure that the specified conditions are acceptable. A resumed or followed run may have no new events.
+        if args.FOLLOW and (args.JOBS > 1 or waveform_store is not None):
+            event_logger.error("--follow reads the events from the database in a single process and cannot be combined with -j or -store. Exitting...")
+            sys.exit()
 
-        # Ensure that the specified conditions are acceptable
-        if args.SEARCH_MIN > args.SEARCH_MAX or args.SEARCH_MIN == args.SEARCH_MAX:
+        if (args.SEARCH_MIN > args.SEARCH_MAX or args.SEARCH_MIN == args.SEARCH_MAX) and not (args.RESUME or args.FOLLOW):
             event_logger.error("Argument [SEARCH_MIN] (" + str(args.SEARCH_MIN) +
                                ") cannot be greater than or equal to argument [SEARCH_MAX] (" + str(args.SEARCH_MAX) + "). Exitting...")
             sys.exit()
 
-        if args.SEARCH_MAX > len(rowEvents):
+        if args.SEARCH_MAX > NUMBER_OF_EVENTS:
             event_logger.error("Argument [SEARCH_MAX] (" + str(args.SEARCH_MAX) +
-                               ") cannot be larger than the total number of events (" + str(len(rowEvents)) + "). Exitting...")
+                               ") cannot be larger than the total number of events (" + str(NUMBER_OF_EVENTS) + "). Exitting...")
             sys.exit()
 
         event_logger.info(
@@ -369,9 +554,15 @@ if __name__ == "__main__":
                           str(NUMBER_OF_CHANNELS))
         event_logger.info("Sampling Frequency: " + str(samplingFreq) + " Hz")
         event_logger.info("Sampling Steps: " + str(samplingStepTime))
+        event_logger.info("Samples index: " + (used_index if used_index is not None else "none (every read scans the samples table)"))
         event_logger.info(
-            "Event range: [" + str(args.SEARCH_MIN) + ", " + str(args.SEARCH_MAX) + ")")
+            "Event range: [" + str(args.SEARCH_MIN) + ", " + ("following" if args.FOLLOW else str(args.SEARCH_MAX)) + ")")
         event_logger.info("Bin range: " + str(args.BIN_RANGE) + " ns")
+        event_logger.info("Envelope: " + args.ENVELOPE)
+        event_logger.info("Coincidence window: " + str(args.WINDOW) + " ns")
+        event_logger.info("Coincidence multiplicity: " + str(args.MULTIPLICITY if args.MULTIPLICITY is not None else default_multiplicity(NUMBER_OF_CHANNELS)))
+        event_logger.info("Frequency filter: " + args.FILTER + " " + str(FILTER_CONFIGS[args.FILTER]))
+        event_logger.info("FFT length: " + args.FFT_LENGTH + ", " + str(spectral.fft_plan(recordLength, args.FFT_LENGTH).size) + " samples")
         event_logger.info(
             "------------------------------------------------------------")
         event_logger.info(
@@ -391,19 +582,24 @@ if __name__ == "__main__":
         cosmic_ray_logger.info(
             "------------------------------------------------------------")
 
+        signal.signal(signal.SIGINT, request_stop)
+
         # Scans each database event
-        search_events(args)
+        if args.FOLLOW:
+            follow_events(args)
+        elif args.JOBS > 1:
+            search_events_parallel(args)
+        else:
+            search_events(args)
+
+        # The final checkpoint lets a later --resume pick up only new events
+        save_progress(args)
+        if results_writer is not None:
+            results_writer.close()
+            event_logger.info("Results written to \"" + args.RESULTS + "\"")
 
         # Saves the final figure to a PDF
-        plt.tight_layout()
-        fig1.canvas.draw()
-        fig2.canvas.draw()
-        fig3.canvas.draw()
-        fig1.savefig(plot_file + "waveforms.pdf", bbox_inches='tight')
-        fig2.savefig(plot_file + "histo.pdf", bbox_inches='tight')
-        fig3.savefig(plot_file + "polar.pdf", bbox_inches='tight')
-
-        event_logger.info("Figures saved to \"" + plot_file + "\"\n")
+        write_outputs(args, run_start)
         event_logger.info(
             "------------------------------------------------------------")
         event_logger.info(
@@ -429,16 +625,10 @@ if __name__ == "__main__":
     except KeyboardInterrupt:
 
         event_logger.info("Keyboard Interrupt. Exitting...\n")
+        event_logger.info("Continue the run with --resume\n")
 
         # Saves the existing figure to a PDF
-        fig1.canvas.draw()
-        fig2.canvas.draw()
-        fig3.canvas.draw()
-        fig1.savefig(plot_file + "waveforms.pdf", bbox_inches='tight')
-        fig2.savefig(plot_file + "histo.pdf", bbox_inches='tight')
-        fig3.savefig(plot_file + "polar.pdf", bbox_inches='tight')
-
-        event_logger.info("Figures saved to \"" + plot_file + "\"\n")
+        write_outputs(args, run_start)
         event_logger.info(
             "------------------------------------------------------------")
         event_logger.info(
@@ -469,14 +659,7 @@ if __name__ == "__main__":
         event_logger.error(e)
 
         # Saves the existing figure to a PDF
-        fig1.canvas.draw()
-        fig2.canvas.draw()
-        fig3.canvas.draw()
-        fig1.savefig(plot_file + "waveforms.pdf", bbox_inches='tight')
-        fig2.savefig(plot_file + "histo.pdf", bbox_inches='tight')
-        fig3.savefig(plot_file + "polar.pdf", bbox_inches='tight')
-
-        event_logger.info("Figures saved to \"" + plot_file + "\"\n")
+        write_outputs(args, run_start)
         event_logger.info(
             "------------------------------------------------------------")
         event_logger.info(
@@ -499,6 +682,5 @@ if __name__ == "__main__":
         cosmic_ray_logger.info(
             "------------------------------------------------------------\n\n")
 
-
-conn.close()
-print("\nConnection closed\n")
+    conn.close()
+    print("\nConnection closed\n")
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+
+# Wall time and call counts of the analysis stages of a run. A stage entered inside
+# another one is subtracted from the outer stage, so the stage times add up to the
+# time spent in the pipeline, and the rest of the run (logging, bookkeeping) shows
+# up as "other" in the summary.
+# Worker processes of a -j run profile their chunks separately and the parent
+# merges them.
+
+import json
+import time as clock
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+
+
+class StageProfile(object):
+
+    def __init__(self):
+        self.seconds = OrderedDict()
+        self.calls = OrderedDict()
+        self.events = 0
+        self.pulses = 0
+        self.nested = [] # Time spent in inner stages of each open stage
+
+    def add(self, stage, seconds, calls = 1):
+        self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+        self.calls[stage] = self.calls.get(stage, 0) + calls
+
+    @contextmanager
+    def stage(self, name):
+        start = clock.perf_counter()
+        self.nested.append(0.0)
+        try:
+            yield
+        finally:
+            elapsed = clock.perf_counter() - start
+            self.add(name, elapsed - self.nested.pop())
+            if self.nested:
+                self.nested[-1] += elapsed
+
+    def merge(self, other):
+        for stage, seconds in other.seconds.items():
+            self.add(stage, seconds, other.calls[stage])
+        self.events += other.events
+        self.pulses += other.pulses
+
+        return self
+
+    # Summary of a run which took wall_time seconds. In a -j run the stage times
+    # are summed over the processes and can exceed the wall time.
+    def summary(self, wall_time):
+        stages = OrderedDict()
+        for stage, seconds in self.seconds.items():
+            stages[stage] = {"seconds": seconds, "calls": self.calls[stage],
+                             "ms_per_call": 1000 * seconds / self.calls[stage] if self.calls[stage] else 0.0}
+        stages["other"] = {"seconds": max(wall_time - sum(self.seconds.values()), 0.0), "calls": 0, "ms_per_call": 0.0}
+
+        return {"wall_time": wall_time, "events": self.events, "pulses": self.pulses,
+                "events_per_second": self.events / wall_time if wall_time > 0 else 0.0,
+                "pulses_per_second": self.pulses / wall_time if wall_time > 0 else 0.0,
+                "stages": stages}
+
+    def table(self, wall_time):
+        summary = self.summary(wall_time)
+        total = sum(stage["seconds"] for stage in summary["stages"].values())
+
+        lines = ["{:<16}{:>11}{:>9}{:>11}{:>8}".format("stage", "seconds", "calls", "ms/call", "share")]
+        for name, stage in summary["stages"].items():
+            lines.append("{:<16}{:>11.3f}{:>9}{:>11.3f}{:>7.1f}%".format(name, stage["seconds"], stage["calls"], stage["ms_per_call"],
+                                                                        100 * stage["seconds"] / total if total > 0 else 0.0))
+        lines.append("{} events in {:.1f} s: {:.2f} events/s, {:.2f} pulses/s".format(
+            summary["events"], wall_time, summary["events_per_second"], summary["pulses_per_second"]))
+
+        return lines
+
+    def write_json(self, path, wall_time):
+        with open(path, "w") as f:
+            json.dump(self.summary(wall_time), f, indent = 2)
+
+    # Pickled without the open stages, for the results of worker processes
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["nested"] = []
+        return state
+
+
+# Profile of the events analyzed by this process
+profile = StageProfile()
+
+
+# Adds every call of the decorated function to stage of the current profile
+def timed(stage):
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with profile.stage(stage):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# Yields the items of iterable, adding the time to get each one to stage
+def iterate(stage, iterable):
+    iterator = iter(iterable)
+    while True:
+        with profile.stage(stage):
+            item = next(iterator, StopIteration)
+        if item is StopIteration:
+            return
+        yield item
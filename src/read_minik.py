@@ -1,6 +1,7 @@
 #!usr/bin/env python3
 
 #import pandas as pd
+import os
 import logging
 import numpy as np
 
@@ -43,44 +44,113 @@ minik_logger = setup_logger("minik_logger", "minik_log.txt", consol = True)
 #def read_event():
 #	return
 
-in_file  = open("/home/user/Desktop/rise/Antenna-Analysis/databases/Measurement_20180710/minik_20180710.txt", "r")
+minik_file = "/home/user/Desktop/rise/Antenna-Analysis/databases/Measurement_20180710/minik_20180710.txt"
 
+MATCH_TOLERANCE = 5 # Largest difference between antenna and MiniK timestamps in seconds
 
+# Columns of a MiniK line which are kept in the index
+MINIK_DTYPE = np.dtype([("event_num", np.int64), ("timestamp", np.int64), ("azimuth", np.float64), ("zenith", np.float64)])
+
+
+# Reads the MiniK events of a minik_*.txt file, sorted by timestamp
+def parse_minik(path):
+	rows = []
+	with open(path, "r") as minik:
+		for line in minik:
+			data_line = line.split("\t")
+
+			# Lines which end with a tab continue on the next line
+			while data_line[-1] == "\n":
+				data_line.pop(-1)
+				data_line += minik.readline().split("\t")
+
+			if len(data_line) < 5:
+				continue
+			rows.append((int(data_line[0]), int(data_line[1]), float(data_line[3]), float(data_line[4])))
+
+	events = np.array(rows, dtype = MINIK_DTYPE)
+
+	return events[np.argsort(events["timestamp"], kind = "stable")]
+
+
+# Binary cache of the parsed file, rebuilt when the text file is newer
+def cache_path(path):
+	return os.path.splitext(path)[0] + ".npz"
+
+
+def load_minik(path):
+	source_mtime = os.path.getmtime(path)
+	cache = cache_path(path)
+
+	if os.path.exists(cache):
+		with np.load(cache) as cached:
+			if float(cached["source_mtime"]) == source_mtime:
+				return cached["events"]
+
+	events = parse_minik(path)
+	try:
+		np.savez(cache, events = events, source_mtime = source_mtime)
+	except (IOError, OSError):
+		pass # The index still works without a cache, it is only rebuilt next time
+
+	return events
+
+
+# Sorted arrays of all MiniK events of one file
+class MinikIndex(object):
+
+	def __init__(self, path):
+		self.path = path
+		self.events = load_minik(path)
+
+		# Only events with a reconstructed direction can be matched
+		valid = ~np.isnan(self.events["azimuth"]) & ~np.isnan(self.events["zenith"])
+		self.valid_events = self.events[valid]
+
+	def __len__(self):
+		return len(self.events)
+
+	# Matches antenna timestamps (seconds) to the first MiniK event with a direction within
+	# tolerance. Returns (found, event_num, timestamp, azimuth, zenith) arrays; azimuth and
+	# zenith are in degrees and all values are 0 where nothing was found.
+	def match(self, ant_timestamps, tolerance = MATCH_TOLERANCE):
+		ant_timestamps = np.atleast_1d(np.asarray(ant_timestamps, dtype = np.float64))
+		timestamps = self.valid_events["timestamp"]
+
+		first = np.searchsorted(timestamps, ant_timestamps - tolerance, side = "left")
+		found = first < len(timestamps)
+		found[found] &= timestamps[first[found]] <= ant_timestamps[found] + tolerance
+
+		matched = self.valid_events[first[found]]
+		event_num = np.zeros(len(ant_timestamps), dtype = np.int64)
+		timestamp = np.zeros(len(ant_timestamps), dtype = np.int64)
+		azimuth = np.zeros(len(ant_timestamps))
+		zenith = np.zeros(len(ant_timestamps))
+
+		event_num[found] = matched["event_num"]
+		timestamp[found] = matched["timestamp"]
+		azimuth[found] = np.round(matched["azimuth"], 4)
+		zenith[found] = np.round(matched["zenith"] * (180 / np.pi), 4) # Converts the mk_zenith from radians to degrees
+
+		return found, event_num, timestamp, azimuth, zenith
+
+
+minik_index = None # Built from minik_file on the first call of find_mk_event
+
+
+# (event_num, timestamp, azimuth, zenith) of the MiniK event matching an antenna
+# timestamp, or None if there is none
 def find_mk_event(ant_timestamp):
+	global minik_index
+
+	if minik_index is None:
+		minik_index = MinikIndex(minik_file)
+
+	found, event_num, timestamp, azimuth, zenith = minik_index.match(ant_timestamp)
+	if not found[0]:
+		return None
 
-	# print("Searching MiniK data...")
-	# print(df)
-	# df.iloc[0]["timestamp"]
-	# print(tim)
-
-	# print("... Completed.")
-
-	for line in in_file:
-		data_line = line.split("\t")#.strip("\n").strip("\t")
-		# print(data_line)
-		
-		if data_line[-1] == "\n":
-			data_line.pop(-1)
-			data_line += in_file.readline().split("\t")
-
-		event_num = int(data_line[0])
-		timestamp = int(data_line[1])
-		
-		if timestamp >= (ant_timestamp - 5) and timestamp <= (ant_timestamp + 5):
-			azimuth = float(data_line[3])
-			zenith = float(data_line[4])
-			if not np.isnan(azimuth) and not np.isnan(zenith):
-				print(data_line[3])
-				print(data_line[4])
-				azimuth = round(azimuth, 4)
-				zenith = round(zenith * (180 / np.pi), 4)	 # Converts the mk_zenith from radians to degrees
-			
-				return event_num, timestamp, azimuth, zenith
-			#minik_logger.info("    Shared Event:")
-			#minik_logger.info("        Antenna:\tEvent " + str(ant_event_num) + "\tTime: "str(time) + " ns")
-			#minik_logger.info("        MiniK:\tEvent " + str(event_num) + "\tTime: "str(timestamp) + " ns")
-		elif timestamp > (ant_timestamp + 5):
-			return 0, 0, 0, 0
+	return int(event_num[0]), int(timestamp[0]), float(azimuth[0]), float(zenith[0])
 
 '''
 if __name__  == "__main__":
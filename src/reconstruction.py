@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+
+# Plane wave direction reconstruction from the signal arrival times at the antennas.
+# Method derived from arXiv:1702.04902
+#
+# The geometry of a triple (plane normal, rotation into the antenna plane, its inverse
+# and the rotated antenna positions) only depends on the array layout, so it is
+# computed once for every triple of the layout. Arrival times are then solved for all
+# triples and events at once.
+#
+# AntennaLayout.fit instead fits one plane wave to all antennas with a signal by
+# linear least squares, for many events of mixed multiplicity in one call.
+
+import numpy as np
+from itertools import combinations
+
+
+SPEED_OF_LIGHT = 0.299792458 # In meters per nanosecond
+RAD_TO_DEG = 57.2958
+NORTH_OFFSET = 75 # Angle between the antenna azimuth and true North in degrees
+
+# Antenna positions (x, y, z) in meters in the MiniK coordinate system
+ANTENNA_POSITIONS = np.array([[-9.5127, -1.3129, 0.001],
+                              [-0.3003, 24.6127, 0.001],
+                              [8.0528, 28.1278, 0],
+                              [11.3887, 20.8345, 0]])
+
+# Channels 2a and 2a + 1 are the two polarizations of antenna a
+POLARITIES = ["EVEN", "ODD"]
+
+
+# Rotation which maps the normal of the plane through the three antennas onto the z axis
+def triple_rotation(antennas):
+    antennas = np.asarray(antennas, dtype = np.float64)
+
+    # D is a unit vector
+    normal = np.cross(antennas[1] - antennas[0], antennas[2] - antennas[0])
+    D = normal / np.linalg.norm(normal)
+    D_x, D_y, D_z = D
+
+    A_tilde = np.zeros((3, 3))
+    xy_sqrt = np.sqrt(np.square(D_x) + np.square(D_y))
+    A_tilde[0][0] = (D_x * D_z) / xy_sqrt
+    A_tilde[0][1] = (D_y * D_z) / xy_sqrt
+    A_tilde[0][2] = np.negative(xy_sqrt)
+    A_tilde[1][0] = np.negative(D_y) / xy_sqrt
+    A_tilde[1][1] = D_x / xy_sqrt
+    A_tilde[2][0] = D_x
+    A_tilde[2][1] = D_y
+    A_tilde[2][2] = D_z
+
+    return A_tilde
+
+
+class AntennaLayout(object):
+
+    # positions holds the (x, y, z) coordinates of each antenna in meters
+    def __init__(self, positions):
+        self.positions = np.asarray(positions, dtype = np.float64)
+        self.triples = list(combinations(range(len(self.positions)), 3))
+        self.triple_index = {triple: i for i, triple in enumerate(self.triples)}
+
+        self.rotations = np.array([triple_rotation(self.positions[list(triple)]) for triple in self.triples])
+        self.inverse_rotations = np.linalg.inv(self.rotations)
+
+        # Antenna positions of each triple in the rotated frame, shape (triples, 3, 3)
+        self.rotated = np.einsum("tij,tkj->tki", self.rotations, self.positions[np.array(self.triples)])
+
+        r = self.rotated
+        self.denominators = ((r[:, 2, 0] - r[:, 0, 0]) * (r[:, 1, 1] - r[:, 0, 1])) - ((r[:, 1, 0] - r[:, 0, 0]) * (r[:, 2, 1] - r[:, 0, 1]))
+
+        # Best fitting plane of the whole layout for the least squares fit. The rows of
+        # plane_rotation are the two in-plane axes and the upward plane normal.
+        centered = self.positions - self.positions.mean(axis = 0)
+        axes = np.linalg.svd(centered)[2]
+        if axes[2, 2] < 0:
+            axes = -axes
+        if np.linalg.det(axes) < 0:
+            axes[1] = -axes[1]
+        self.plane_rotation = axes
+        self.plane_positions = centered.dot(axes[:2].T)
+
+    def __len__(self):
+        return len(self.positions)
+
+    # Index of the triple of antennas a < b < c
+    def triple(self, a, b, c):
+        return self.triple_index[(a, b, c)]
+
+    # Solves the plane wave direction for arrays of triple indices and (M, 3) arrival times in ns.
+    # Returns (reconstructed, azimuth, zenith) arrays in degrees, azimuth relative to true North.
+    def reconstruct(self, triple_index, times):
+        triple_index = np.asarray(triple_index, dtype = np.int64)
+        times = np.asarray(times, dtype = np.float64).reshape(-1, 3)
+
+        r = self.rotated[triple_index]
+        denominators = self.denominators[triple_index]
+        t_01 = times[:, 0] - times[:, 1]
+        t_02 = times[:, 0] - times[:, 2]
+
+        d_x_prime = SPEED_OF_LIGHT * ((t_02 * (r[:, 1, 1] - r[:, 0, 1])) - (t_01 * (r[:, 2, 1] - r[:, 0, 1]))) / denominators
+        d_y_prime = SPEED_OF_LIGHT * ((t_01 * (r[:, 2, 0] - r[:, 0, 0])) - (t_02 * (r[:, 1, 0] - r[:, 0, 0]))) / denominators
+
+        with np.errstate(invalid = "ignore", divide = "ignore"):
+            d_z_prime = np.sqrt(1 - np.square(d_x_prime) - np.square(d_y_prime))
+
+            # d_prime is a unit vector for a physical solution
+            d_prime = np.stack((d_x_prime, d_y_prime, d_z_prime), axis = -1)
+            norm = np.linalg.norm(d_prime, axis = -1)
+            reconstructed = (norm >= 0.999) & (norm < 1.0001)
+
+            d = np.einsum("mij,mj->mi", self.inverse_rotations[triple_index], d_prime)
+
+        azimuth, zenith = direction_angles(d)
+        reconstructed &= ~np.isnan(azimuth)
+
+        return reconstructed, azimuth, zenith
+
+    # Least squares plane wave fit to all antennas with a signal.
+    # times has shape (M, antennas) in ns; missing antennas are NaN or False in mask.
+    # The antennas are projected onto the plane which fits the layout best, and
+    # c (t_i - t_mean) = -d' . (r_i - r_mean) is solved for the in-plane direction d'.
+    # Returns (reconstructed, azimuth, zenith, rms, residuals); the residuals are the
+    # differences between the measured and fitted arrival times in ns (NaN where missing).
+    def fit(self, times, mask = None):
+        times = np.asarray(times, dtype = np.float64).reshape(-1, len(self))
+        if mask is None:
+            mask = ~np.isnan(times)
+        mask = np.asarray(mask, dtype = bool).reshape(times.shape)
+        weights = mask.astype(np.float64)
+        filled = np.where(mask, times, 0.0)
+        counts = weights.sum(axis = 1)
+
+        with np.errstate(invalid = "ignore", divide = "ignore"):
+            # Centered in-plane antenna coordinates and arrival times of every row
+            center = np.einsum("ma,ak->mk", weights, self.plane_positions) / counts[:, np.newaxis]
+            offsets = self.plane_positions[np.newaxis, :, :] - center[:, np.newaxis, :]
+            offsets = np.where(mask[:, :, np.newaxis], offsets, 0.0)
+            t_mean = filled.sum(axis = 1) / counts
+            t_offsets = np.where(mask, filled - t_mean[:, np.newaxis], 0.0)
+
+            normal = np.einsum("mai,maj->mij", offsets, offsets)
+            rhs = -SPEED_OF_LIGHT * np.einsum("mai,ma->mi", offsets, t_offsets)
+
+            # At least three antennas which are not on one line are needed
+            determinant = np.linalg.det(normal)
+            solvable = (counts >= 3) & (np.abs(determinant) > 1e-9 * np.square(np.einsum("mii->m", normal)))
+            normal[~solvable] = np.eye(2)
+            d_plane = np.linalg.solve(normal, rhs[:, :, np.newaxis])[:, :, 0]
+
+            d_z_prime = np.sqrt(1 - np.square(d_plane[:, 0]) - np.square(d_plane[:, 1]))
+            d = np.einsum("ji,mj->mi", self.plane_rotation, np.column_stack((d_plane, d_z_prime)))
+
+            residuals = t_offsets + np.einsum("mai,mi->ma", offsets, d_plane) / SPEED_OF_LIGHT
+            residuals = np.where(mask, residuals, np.nan)
+            rms = np.sqrt(np.nansum(np.square(residuals), axis = 1) / counts)
+
+            azimuth, zenith = direction_angles(d)
+
+        reconstructed = solvable & ~np.isnan(d_z_prime) & ~np.isnan(azimuth)
+
+        return reconstructed, azimuth, zenith, rms, residuals
+
+
+# Azimuth (relative to true North) and zenith in degrees of (M, 3) unit vectors pointing to the source
+def direction_angles(d):
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        zenith = np.arccos(d[:, 2])
+        azimuth = np.arccos(d[:, 0] / np.sin(zenith))
+
+    zenith *= RAD_TO_DEG
+    azimuth *= RAD_TO_DEG
+
+    azimuth = np.where(d[:, 1] > 0, 360 - azimuth, azimuth)
+    zenith = np.where(d[:, 2] < 0, 180 - zenith, zenith)
+
+    # Relates the antenna azimuth with true North.
+    azimuth = (azimuth + 360 - NORTH_OFFSET) % 360
+
+    return azimuth, zenith
+
+
+# Unit vectors pointing to sources at azimuth (relative to true North) and zenith in
+# degrees, the inverse of direction_angles. Returns shape (M, 3).
+def direction_vector(azimuth, zenith):
+    phi = np.radians((np.asarray(azimuth, dtype = np.float64) + NORTH_OFFSET) % 360)
+    theta = np.radians(np.asarray(zenith, dtype = np.float64))
+
+    return np.column_stack((np.sin(theta) * np.cos(phi), -np.sin(theta) * np.sin(phi), np.cos(theta)))
+
+
+# Plane wave arrival times in ns at the antennas relative to the layout center, shape (M, antennas)
+def arrival_times(positions, azimuth, zenith):
+    positions = np.asarray(positions, dtype = np.float64)
+    d = direction_vector(azimuth, zenith)
+
+    return -np.einsum("mi,ai->ma", d, positions - positions.mean(axis = 0)) / SPEED_OF_LIGHT
+
+
+# Antenna triples of a coincidence. Returns (polarity, antennas, times) for every
+# triple of antennas which saw a signal in the same polarization.
+def collect_triples(signals):
+    triples = []
+    for polarity_number, polarity in enumerate(POLARITIES):
+        channel_signals = sorted([signal for signal in signals if int(signal[0]) % 2 == polarity_number], key = lambda signal: signal[0])
+        antennas = [int(signal[0]) // 2 for signal in channel_signals]
+        times = [signal[1] for signal in channel_signals]
+
+        for i, j, k in combinations(range(len(antennas)), 3):
+            triples.append((polarity, (antennas[i], antennas[j], antennas[k]), (times[i], times[j], times[k])))
+
+    return triples
+
+
+# Arrival times of a coincidence as a (polarities, antennas) array, NaN where an antenna has no signal
+def coincidence_times(signals, number_of_antennas):
+    times = np.full((len(POLARITIES), number_of_antennas), np.nan)
+    for signal in signals:
+        channel = int(signal[0])
+        if np.isnan(times[channel % 2, channel // 2]):
+            times[channel % 2, channel // 2] = signal[1]
+
+    return times
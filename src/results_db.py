@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+# Structured results of an analysis run in an SQLite file, so that later studies can
+# select events, pulses and directions with a query instead of rerunning the analysis
+# or parsing the logs. Every table has the row, database event id and timestamp of
+# the event. Rows are appended from the RunResults in one transaction per write and
+# then cleared from it.
+
+import sqlite3
+
+
+RESULTS_NAME = "results.db"
+
+# Columns of each table. Times are in ns, amplitudes in mV and angles in degrees.
+TABLES = [
+    ("events", ["row INTEGER PRIMARY KEY", "event_id INTEGER", "time_stamp REAL", "coincidence INTEGER"]),
+    ("peaks", ["row INTEGER", "event_id INTEGER", "time_stamp REAL", "channel INTEGER", "peak_time REAL", "peak_amplitude REAL"]),
+    ("pulses", ["row INTEGER", "event_id INTEGER", "time_stamp REAL", "channel INTEGER", "begin_time REAL", "end_time REAL",
+                "peak_amplitude REAL"]),
+    ("coincidences", ["row INTEGER", "event_id INTEGER", "time_stamp REAL", "coincidence INTEGER", "channels TEXT",
+                      "begin_time REAL", "end_time REAL"]),
+    ("reconstructions", ["row INTEGER", "event_id INTEGER", "time_stamp REAL", "coincidence INTEGER", "polarity TEXT",
+                         "azimuth REAL", "zenith REAL", "rms REAL", "mk_azimuth REAL", "mk_zenith REAL"]),
+]
+
+
+# NULL in the results file for a missing value, e.g. the MiniK angles without a MiniK match
+def optional_float(value):
+    return float(value) if value is not None else None
+
+
+class ResultsWriter(object):
+
+    # Starts a new results file, or continues one with resume_row set to the first row
+    # of a resumed run. Rows from resume_row on were written after the checkpoint and
+    # are removed.
+    def __init__(self, path, resume_row = None):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+
+        with self.conn:
+            for name, columns in TABLES:
+                if resume_row is None:
+                    self.conn.execute("DROP TABLE IF EXISTS " + name)
+                self.conn.execute("CREATE TABLE IF NOT EXISTS " + name + " (" + ", ".join(columns) + ")")
+                if name != "events":
+                    self.conn.execute("CREATE INDEX IF NOT EXISTS " + name + "_row ON " + name + " (row)")
+                if resume_row is not None:
+                    self.conn.execute("DELETE FROM " + name + " WHERE row >= ?", (resume_row,))
+
+    # Appends the rows of results and clears them from results once they are committed
+    def write(self, results):
+        events = results.events
+        keys = {row: (event_id, timestamp) for row, event_id, timestamp, coincidence in events}
+
+        def key(row):
+            return keys.get(row, (None, None))
+
+        peaks = [(row,) + key(row) + (chan_num, float(peak_time), float(amplitude))
+                 for row, chan_num, peak_time, amplitude in results.peaks]
+        pulses = [(row,) + key(row) + (chan_num, float(begin), float(end), amplitude)
+                  for row, chan_num, begin, end, amplitude in results.signals]
+        coincidences = [(row,) + key(row) + (number, " ".join(str(channel) for channel in channels), float(begin), float(end))
+                        for row, timestamp, channels, begin, end, number in results.coincidences]
+        reconstructions = [(row,) + key(row) + (coincidence, polarity, float(azimuth), float(zenith), float(rms),
+                                                optional_float(mk_azimuth), optional_float(mk_zenith))
+                           for row, timestamp, polarity, azimuth, zenith, mk_azimuth, mk_zenith, rms, coincidence
+                           in results.directions]
+
+        with self.conn:
+            self.conn.executemany("INSERT INTO events VALUES (?, ?, ?, ?)",
+                                  [(row, event_id, timestamp, int(coincidence)) for row, event_id, timestamp, coincidence in events])
+            self.conn.executemany("INSERT INTO peaks VALUES (?, ?, ?, ?, ?, ?)", peaks)
+            self.conn.executemany("INSERT INTO pulses VALUES (?, ?, ?, ?, ?, ?, ?)", pulses)
+            self.conn.executemany("INSERT INTO coincidences VALUES (?, ?, ?, ?, ?, ?, ?)", coincidences)
+            self.conn.executemany("INSERT INTO reconstructions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", reconstructions)
+
+        results.clear_rows()
+
+    def close(self):
+        self.conn.close()
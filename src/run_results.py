@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+
+# Results of an analysis run which are needed after the events have been processed.
+# Worker processes each fill their own RunResults for a chunk of events, and the
+# parent merges them in event order, so a parallel run ends with the same results
+# as a serial one.
+#
+# The per event rows (events, peaks, signals, coincidences, directions) only wait
+# here until ResultsWriter has stored them, then they are cleared. Everything the
+# figures and statistics need is accumulated in totals and counts arrays, so the
+# memory of a run does not grow with its number of events.
+
+import numpy as np
+
+from signal_histogram import SignalHistogram
+from sky_map import SkyMap
+
+
+class RunResults(object):
+
+    def __init__(self):
+        self.events_analyzed = 0
+        self.next_row = None # Row after the last completely analyzed event
+        self.last_event_id = None # Database id of that event
+        self.events = [] # (row, event_id, timestamp, coincidence) of every analyzed event
+        self.peaks = [] # (row, channel, time, amplitude) of every envelope peak
+        self.signals = [] # (row, channel, begin, end, amplitude) of every signal
+        self.coincidences = [] # (row, timestamp, channels, begin, end, number) of every coincidence
+        self.directions = [] # (row, timestamp, polarity, azimuth, zenith, mk_azimuth, mk_zenith, rms, coincidence) of every reconstruction,
+                             # mk_azimuth and mk_zenith are None without a MiniK match
+
+        # Totals of the run, which stay when the rows are cleared
+        self.coincidence_events = 0
+        self.pulse_count = 0
+        self.coincidence_count = 0
+        self.direction_count = 0
+
+        # Reconstructions with a MiniK match by the difference of the antenna and MiniK azimuths, in whole degrees
+        self.azimuth_differences = np.zeros(360, dtype = np.int64)
+
+        # Histogram and heatmap counts of the reconstructed signals (see signal_histogram.py)
+        self.histogram = None
+
+        # Antenna and MiniK directions on an azimuth/zenith grid (see sky_map.py)
+        self.sky_map = SkyMap()
+
+        # Waveforms of the last event with a coincidence, for the waveform figure
+        self.waveforms = None
+
+    # Marks the event at row as completely analyzed
+    def finish_event(self, row, event_id, timestamp, coincidence):
+        self.events.append((row, event_id, timestamp, coincidence))
+        self.events_analyzed += 1
+        self.coincidence_events += bool(coincidence)
+        self.next_row = row + 1
+        self.last_event_id = event_id
+
+    def add_peaks(self, row, peak_times, peak_amplitudes):
+        for chan_num, (peak_time, amplitude) in enumerate(zip(peak_times, peak_amplitudes)):
+            self.peaks.append((row, chan_num, peak_time, amplitude))
+
+    def add_signals(self, row, signal_list, amplitudes):
+        for (chan_num, begin, end), amplitude in zip(signal_list, amplitudes):
+            self.signals.append((row, chan_num, begin, end, amplitude))
+        self.pulse_count += len(signal_list)
+
+    # number counts the coincidences of the event
+    def add_coincidence(self, row, timestamp, number, group):
+        self.coincidences.append((row, timestamp, group.channels, group.begin, group.end, number))
+        self.coincidence_count += 1
+
+    def add_direction(self, row, timestamp, polarity, azimuth, zenith, mk_azimuth, mk_zenith, rms, coincidence):
+        self.directions.append((row, timestamp, polarity, azimuth, zenith, mk_azimuth, mk_zenith, rms, coincidence))
+        self.direction_count += 1
+        self.sky_map.add(polarity, azimuth, zenith)
+        if mk_azimuth is not None:
+            self.sky_map.add_minik(polarity, mk_azimuth, mk_zenith)
+            self.azimuth_differences[min(int(np.floor(np.abs(azimuth - mk_azimuth))), 359)] += 1
+
+    # Adds the signals of a reconstructed coincidence to the histogram, created on the first call
+    def add_histogram(self, time, number_of_channels, signals, bin_range):
+        if self.histogram is None:
+            self.histogram = SignalHistogram(time, number_of_channels)
+        self.histogram.add(signals, bin_range)
+
+    # waveforms is a dict with the row and everything plot_waveforms needs
+    def set_waveforms(self, waveforms):
+        if self.waveforms is None or waveforms["row"] >= self.waveforms["row"]:
+            self.waveforms = waveforms
+
+    # Empties the per event rows, once they are in the results file
+    def clear_rows(self):
+        del self.events[:]
+        del self.peaks[:]
+        del self.signals[:]
+        del self.coincidences[:]
+        del self.directions[:]
+
+    # Copy with the position of the last finished event, the totals and the counts only,
+    # for checkpoints. Its size does not depend on the number of events analyzed.
+    def accumulated(self):
+        accumulated = RunResults()
+        accumulated.events_analyzed = self.events_analyzed
+        accumulated.next_row = self.next_row
+        accumulated.last_event_id = self.last_event_id
+        accumulated.coincidence_events = self.coincidence_events
+        accumulated.pulse_count = self.pulse_count
+        accumulated.coincidence_count = self.coincidence_count
+        accumulated.direction_count = self.direction_count
+        accumulated.azimuth_differences = self.azimuth_differences
+        accumulated.histogram = self.histogram
+        accumulated.sky_map = self.sky_map
+
+        return accumulated
+
+    # Accumulated results and the last waveforms, for the combined figures of many files.
+    # The per event rows stay in the results file of each run.
+    def summary(self):
+        summary = self.accumulated()
+        summary.waveforms = self.waveforms
+
+        return summary
+
+    # Adds the results of a later chunk of events. Raises ValueError, before anything
+    # is added, if the histograms have different time axes.
+    def merge(self, other):
+        if other.histogram is not None:
+            if self.histogram is None:
+                self.histogram = other.histogram
+            else:
+                self.histogram.merge(other.histogram)
+
+        self.events_analyzed += other.events_analyzed
+        self.coincidence_events += other.coincidence_events
+        self.pulse_count += other.pulse_count
+        self.coincidence_count += other.coincidence_count
+        self.direction_count += other.direction_count
+        self.azimuth_differences += other.azimuth_differences
+        if other.next_row is not None:
+            self.next_row = other.next_row
+            self.last_event_id = other.last_event_id
+        self.events.extend(other.events)
+        self.peaks.extend(other.peaks)
+        self.signals.extend(other.signals)
+        self.coincidences.extend(other.coincidences)
+        self.directions.extend(other.directions)
+        self.sky_map.merge(other.sky_map)
+
+        if other.waveforms is not None:
+            self.set_waveforms(other.waveforms)
+
+        return self
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+# Decodes the samples strings of the WaveDump samples table ("8193 8188 8203 ...")
+# straight into an integer (events, channels, record_length) array, without a Python
+# object per sample.
+#
+# WaveDump writes every ADC count with the same number of digits as long as the
+# signal stays within one decade, e.g. 4 digits around the baseline of a 14 bit
+# digitizer. Then all strings of a block joined by spaces are a fixed width table of
+# bytes, and the counts are a weighted sum of its digit columns. Blocks with counts
+# of different widths are parsed string by string with numpy's C parser.
+
+import numpy as np
+
+
+ADC_DTYPE = np.int16 # Holds the counts of digitizers with up to 15 bits
+SPACE = ord(" ")
+ZERO = ord("0")
+
+
+# Decodes a list of events, each a list of one samples string per channel, into out
+# or a new (events, channels, record_length) array of dtype
+def decode_events(events, number_of_channels, record_length, out = None, dtype = ADC_DTYPE):
+    shape = (len(events), number_of_channels, record_length)
+    if out is None or out.shape != shape:
+        out = np.empty(shape, dtype = dtype)
+
+    for event, texts in enumerate(events):
+        if len(texts) != number_of_channels:
+            raise ValueError("Event " + str(event) + " of the block has " + str(len(texts)) + " channels, expected " +
+                             str(number_of_channels))
+
+    if len(events) != 0 and not decode_fixed_width(events, out):
+        for event, texts in enumerate(events):
+            for channel, text in enumerate(texts):
+                decode_string(text, out[event, channel])
+
+    return out
+
+
+# Decodes the block if all counts have the same number of digits. Returns False otherwise.
+def decode_fixed_width(events, out):
+    text = " ".join(" ".join(texts) for texts in events) + " "
+    counts = out.size
+    if len(text) % counts != 0:
+        return False
+
+    width = len(text) // counts
+    if width < 2 or width > 6:
+        return False
+
+    # A block of the right total length can still hold strings with too few and too
+    # many counts, e.g. 3 and 5 at a record length of 4
+    length = out.shape[-1] * width - 1
+    for texts in events:
+        for text_of_channel in texts:
+            if len(text_of_channel) != length:
+                return False
+
+    # Digits become 0 to 9, every other byte wraps around to 10 or more. The checks run
+    # on the contiguous buffer, strided column views are several times slower.
+    digits = np.frombuffer(text.encode("ascii", "replace"), dtype = np.uint8) - np.uint8(ZERO)
+    if np.count_nonzero(digits < 10) != counts * (width - 1):
+        return False
+    digits = digits.reshape(counts, width)
+    if not (digits[:, -1] == np.uint8(SPACE - ZERO + 256)).all():
+        return False
+
+    values = out.reshape(-1)
+    values[:] = digits[:, 0]
+    for column in range(1, width - 1):
+        values *= 10
+        values += digits[:, column]
+
+    return True
+
+
+# Decodes one samples string into the record_length counts of out
+def decode_string(text, out):
+    values = np.fromstring(text, dtype = out.dtype, sep = " ")
+    if len(values) != len(out):
+        raise ValueError("Samples string has " + str(len(values)) + " values, expected a record length of " + str(len(out)))
+    out[:] = values
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+# Sliding window pulse detection on channel envelopes.
+# All window means of a channel are computed at once from cumulative sums, so the
+# cost no longer grows with the bin range. The intervals are identical to the
+# sample-by-sample search that find_signals used before, except that a signal still
+# open at the end of a channel is no longer carried over into the next one.
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+
+MAX_SIGNAL_WIDTH = 300 # Longest accepted signal in ns
+SIGNAL_THRESHOLD = 0.5 # Fraction of (max - mean) the window mean has to exceed
+
+
+# Means of all windows env[i : i + bin_range] for i in [0, len(env) - bin_range)
+def window_means(env, bin_range):
+    count = len(env) - bin_range
+    sums = np.concatenate(([0.0], np.cumsum(env)))
+
+    return (sums[bin_range : bin_range + count] - sums[:count]) / bin_range
+
+
+# Exact np.mean of the windows starting at index, used where rounding in window_means could matter
+def exact_window_means(env, bin_range, index):
+    windows = as_strided(env, shape = (len(env) - bin_range + 1, bin_range), strides = (env.strides[0],) * 2)
+
+    return np.array([np.mean(windows[i]) for i in index])
+
+
+# Returns [channel, begin, end] for every signal of every channel.
+# A signal begins where the window mean rises above the threshold and ends bin_range
+# after the window where it falls below again (or at the end of the trace). Signals
+# touching the first or last sample, or longer than MAX_SIGNAL_WIDTH, are dropped.
+def detect_signals(time, env_list, bin_range):
+    signal_list = []
+
+    for chan_num, env in enumerate(env_list):
+        # A signal which is still open at the end of a channel touches its last sample, so
+        # it is dropped instead of being carried over into the next channel
+        signal_found = False
+        signal_begin = None
+
+        env = np.ascontiguousarray(np.real(env), dtype = np.float64)
+        count = len(time) - bin_range
+        if count <= 0:
+            continue
+
+        chan_mean = np.mean(env)
+        chan_max = np.max(env)
+        threshold = (chan_max - chan_mean) * SIGNAL_THRESHOLD
+
+        diff = window_means(env, bin_range) - chan_mean
+
+        # Recompute the windows which are within rounding distance of the threshold exactly
+        tolerance = 4 * len(env) * np.finfo(np.float64).eps * (np.abs(env).sum() / bin_range + np.abs(chan_mean))
+        close = np.flatnonzero(np.abs(diff - threshold) <= tolerance)
+        if len(close) != 0:
+            diff[close] = exact_window_means(env, bin_range, close) - chan_mean
+
+        rising = np.flatnonzero(diff > threshold)
+        falling = np.flatnonzero(diff < threshold)
+
+        i = 0
+        while i < count:
+            if not signal_found:
+                k = np.searchsorted(rising, i)
+                if k == len(rising):
+                    break
+                signal_found = True
+                signal_begin = time[rising[k]]
+                i = rising[k] + 1
+
+            else:
+                k = np.searchsorted(falling, i)
+                end_index = falling[k] if k != len(falling) else count - 1
+                signal_found = False
+                signal_end = time[end_index + bin_range]
+                i = end_index + 1
+
+                if (signal_begin != time[0] and signal_end != time[-1]) and ((signal_end - signal_begin) < MAX_SIGNAL_WIDTH):
+                    signal_list.append([chan_num, signal_begin, signal_end])
+
+    return signal_list
+
+
+# Largest envelope value between the begin and end of each [channel, begin, end] signal,
+# NaN for an interval without samples
+def signal_amplitudes(time, env_list, signal_list):
+    time = np.asarray(time)
+    amplitudes = []
+    for chan_num, begin, end in signal_list:
+        first = np.searchsorted(time, begin, side = "left")
+        last = np.searchsorted(time, end, side = "right")
+        if last > first:
+            amplitudes.append(float(np.max(np.real(env_list[chan_num][first:last]))))
+        else:
+            amplitudes.append(np.nan)
+
+    return amplitudes
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+# Per channel counts of the reconstructed signals on a 1 ns time axis, for the
+# histogram and heatmap figures. The histogram counts the signal onsets in bins of
+# bin_range ns, the heatmap counts how often each ns is covered by a signal.
+# Both are intervals of the time axis. Each signal adds +1 at the start and -1 at the
+# end of its interval to a difference array, so adding a coincidence costs the same
+# for any pulse width, and the counts are the cumulative sum when they are drawn.
+
+import numpy as np
+
+
+class SignalHistogram(object):
+
+    # time is the analysis time axis in ns, its first and last values span the histogram
+    def __init__(self, time, number_of_channels):
+        self.time = np.arange(time[0], time[-1] + 1, step = 1)
+        self.histo_edges = np.zeros((number_of_channels, len(self.time) + 1), dtype = np.int64)
+        self.heat_edges = np.zeros((number_of_channels, len(self.time) + 1), dtype = np.int64)
+
+    # Index of each time on the 1 ns axis
+    def index(self, times):
+        return np.rint(np.asarray(times, dtype = np.float64) - self.time[0]).astype(np.int64)
+
+    # signals are [channel, begin, end] in ns
+    def add(self, signals, bin_range):
+        if len(signals) == 0:
+            return
+
+        signals = np.asarray(signals, dtype = np.float64).reshape(-1, 3)
+        channels = signals[:, 0].astype(np.int64)
+        begin = self.index(signals[:, 1])
+        length = len(self.time)
+
+        # bin_range ns from the start of the bin of the onset, the last ns of the axis is never counted
+        start = begin - begin % bin_range
+        self.add_intervals(self.histo_edges, channels, start, np.minimum(start + bin_range, length - 1))
+
+        # Every ns from the onset up to the end of the signal
+        width = (signals[:, 2] - signals[:, 1]).astype(np.int64)
+        self.add_intervals(self.heat_edges, channels, begin, np.minimum(begin + width, length))
+
+    @staticmethod
+    def add_intervals(edges, channels, start, stop):
+        start = np.clip(start, 0, edges.shape[1] - 1)
+        stop = np.maximum(np.clip(stop, 0, edges.shape[1] - 1), start)
+        np.add.at(edges, (channels, start), 1)
+        np.add.at(edges, (channels, stop), -1)
+
+    def matches(self, other):
+        return self.histo_edges.shape == other.histo_edges.shape and np.array_equal(self.time, other.time)
+
+    @property
+    def histo(self):
+        return np.cumsum(self.histo_edges, axis = 1)[:, :-1]
+
+    @property
+    def heat(self):
+        return np.cumsum(self.heat_edges, axis = 1)[:, :-1]
+
+    # Adds the counts of a histogram with the same time axis and number of channels. Runs
+    # with other record lengths or post trigger settings have other axes, their counts
+    # cannot be added bin by bin.
+    def merge(self, other):
+        if not self.matches(other):
+            raise ValueError("Cannot merge a histogram of " + str(other.histo_edges.shape[0]) + " channels on [" +
+                             str(other.time[0]) + ", " + str(other.time[-1]) + "] ns into one of " +
+                             str(self.histo_edges.shape[0]) + " channels on [" + str(self.time[0]) + ", " +
+                             str(self.time[-1]) + "] ns")
+
+        self.histo_edges += other.histo_edges
+        self.heat_edges += other.heat_edges
+
+        return self
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+# Counts of the reconstructed directions on an azimuth/zenith grid, one map per
+# polarization for the antenna directions and one for the MiniK directions of the
+# coincidences with a MiniK match. The figure draws the counts as one pcolormesh per
+# map, so it costs the same for ten or a million reconstructions.
+
+import numpy as np
+
+from reconstruction import POLARITIES
+
+
+AZIMUTH_BIN = 5.0 # degrees
+ZENITH_BIN = 2.0 # degrees
+MAX_ZENITH = 90.0 # degrees
+
+
+class SkyMap(object):
+
+    def __init__(self, azimuth_bin = AZIMUTH_BIN, zenith_bin = ZENITH_BIN):
+        self.azimuth_edges = np.arange(0, 360 + azimuth_bin / 2, azimuth_bin)
+        self.zenith_edges = np.arange(0, MAX_ZENITH + zenith_bin / 2, zenith_bin)
+
+        shape = (len(POLARITIES), len(self.azimuth_edges) - 1, len(self.zenith_edges) - 1)
+        self.antenna = np.zeros(shape, dtype = np.int64)
+        self.minik = np.zeros(shape, dtype = np.int64)
+
+    # Indices of the bins of directions in degrees. Directions which are not finite or
+    # have a zenith outside [0, 90] get -1.
+    def bins(self, azimuth, zenith):
+        azimuth = np.asarray(azimuth, dtype = np.float64)
+        zenith = np.asarray(zenith, dtype = np.float64)
+        with np.errstate(invalid = "ignore"):
+            valid = np.isfinite(azimuth) & (zenith >= 0) & (zenith <= MAX_ZENITH)
+        azimuth = np.mod(np.where(valid, azimuth, 0), 360)
+        zenith = np.where(valid, zenith, 0)
+
+        a = np.minimum((azimuth / (self.azimuth_edges[1] - self.azimuth_edges[0])).astype(np.int64), self.antenna.shape[1] - 1)
+        z = np.minimum((zenith / (self.zenith_edges[1] - self.zenith_edges[0])).astype(np.int64), self.antenna.shape[2] - 1)
+
+        return np.where(valid, a, -1), z
+
+    # Adds antenna directions in degrees, polarities are names of POLARITIES. All
+    # arguments are scalars or arrays of the same length.
+    def add(self, polarities, azimuth, zenith):
+        self.count(self.antenna, polarities, azimuth, zenith)
+
+    # Adds the MiniK directions of matched coincidences, like add
+    def add_minik(self, polarities, mk_azimuth, mk_zenith):
+        self.count(self.minik, polarities, mk_azimuth, mk_zenith)
+
+    def count(self, counts, polarities, azimuth, zenith):
+        p = np.atleast_1d([POLARITIES.index(polarity) for polarity in np.atleast_1d(polarities)])
+        a, z = self.bins(azimuth, zenith)
+        a, z = np.atleast_1d(a), np.atleast_1d(z)
+        found = a >= 0
+        np.add.at(counts, (p[found], a[found], z[found]), 1)
+
+    def merge(self, other):
+        self.antenna += other.antenna
+        self.minik += other.minik
+
+        return self
+
+    def __len__(self):
+        return int(self.antenna.sum())
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+# Batched real FFT of waveform blocks.
+# All channels (and events) of a (..., N) block are transformed along the last
+# axis in one call. Waveforms are real, so only the N // 2 + 1 non-negative
+# frequency bins are computed and stored.
+
+import numpy as np
+import scipy.fft
+from functools import lru_cache
+
+
+FFT_WORKERS = -1 # Number of threads used by scipy.fft, -1 uses all cores
+
+TRIM = "trim"
+PAD = "pad"
+FFT_LENGTH_MODES = [TRIM, PAD]
+
+
+# Frequency of each rfft bin in MHz. Computed once per (N, sampling frequency).
+@lru_cache(maxsize = 32)
+def frequency_axis(n, sampling_freq):
+    freq = scipy.fft.rfftfreq(n, 1.0 / sampling_freq) * 10**(-6)
+    freq.setflags(write = False) # Shared between all callers
+
+    return freq
+
+
+# Spectrum of a (..., N) block of real waveforms, zero-padded to n samples if n is given.
+# workers defaults to FFT_WORKERS at call time.
+def forward(block, workers = None, n = None):
+    if workers is None:
+        workers = FFT_WORKERS
+
+    return scipy.fft.rfft(block, n = n, axis = -1, workers = workers)
+
+
+# Real waveforms of length n from a (..., n // 2 + 1) spectrum block
+def inverse(spectrum, n, workers = None):
+    if workers is None:
+        workers = FFT_WORKERS
+
+    return scipy.fft.irfft(spectrum, n = n, axis = -1, workers = workers)
+
+
+# Slice which trims a record of n samples symmetrically to the largest power of two,
+# and log2(n). A record which already has a power of two length is kept whole.
+def power_of_two_trim(n):
+    exp = np.log(int(n)) / np.log(2)
+    expDif = int(n) - 2 ** int(exp)
+    trim = slice(expDif // 2, expDif // 2 + 2 ** int(exp))
+
+    return exp, trim
+
+
+# How a record of n samples goes through the FFT. "trim" keeps the central power of
+# two samples (see power_of_two_trim), "pad" keeps the whole record and zero-pads it
+# to the next length scipy.fft transforms quickly. The filtered waveforms are cropped
+# back to the kept samples.
+class FFTPlan(object):
+
+    def __init__(self, n, mode = TRIM):
+        if mode not in FFT_LENGTH_MODES:
+            raise ValueError("Unknown FFT length mode " + str(mode) + ", expected one of " + ", ".join(FFT_LENGTH_MODES))
+
+        self.exp, self.trim = power_of_two_trim(n)
+        if mode == TRIM:
+            self.size = 2 ** int(self.exp)
+        else:
+            self.trim = slice(None)
+            self.size = scipy.fft.next_fast_len(int(n), real = True)
+        self.samples = len(range(int(n))[self.trim]) # Samples kept of each record
+        self.mode = mode
+
+    # Spectrum of the kept samples of a (..., samples) block, zero-padded to size
+    def forward(self, block, workers = None):
+        return forward(block, workers, self.size)
+
+    # Kept samples of the waveforms of a (..., size // 2 + 1) spectrum block
+    def inverse(self, spectrum, workers = None):
+        return inverse(spectrum, self.size, workers)[..., :self.samples]
+
+
+# Plans are computed once per record length and mode
+@lru_cache(maxsize = 32)
+def fft_plan(n, mode = TRIM):
+    return FFTPlan(n, mode)
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+# Writes a synthetic WaveDump database with the tables of the acquisition (digitizer,
+# settings_root, settings_dcoffsets, events, samples), so that the analysis can be
+# run and benchmarked without a measurement. Every channel has Gaussian noise around
+# its DC offset. A fraction of the events has a plane wave pulse from a random
+# direction, which reaches every antenna at the time given by the antenna layout.
+# The true directions are written to an extra table, synthetic_truth.
+#
+# Usage: python synthetic_wavedump.py output.db -events 1000
+
+import argparse
+import os
+import sqlite3
+import numpy as np
+
+from calibration import ADC_BITS, DC_OFFSET_RANGE
+from reconstruction import ANTENNA_POSITIONS, arrival_times
+
+
+SAMPLING_FREQUENCY = 1e9 # Hz
+RECORD_LENGTH = 4200 # Samples per channel
+POST_TRIGGER = 40 # Percentage of the record after the trigger
+NUMBER_OF_CHANNELS = 8 # Two polarizations per antenna
+DC_OFFSET = 32768 # Raw DAC value of settings_dcoffsets
+
+NOISE = 20.0 # Standard deviation of the noise in ADC counts
+PULSE_FRACTION = 0.5 # Fraction of events with a pulse
+PULSE_AMPLITUDE = 600.0 # ADC counts
+PULSE_FREQUENCY = 55e6 # Hz, inside the cosmic ray band of frequencyCut.py
+PULSE_WIDTH = 15.0 # Gaussian width of the pulse in ns
+PULSE_TIME = -800.0 # Mean arrival time at the center of the layout in ns
+PULSE_JITTER = 200.0 # Arrival times at the center are uniform in PULSE_TIME +- PULSE_JITTER
+MAX_ZENITH = 60.0 # Pulse directions are uniform in azimuth and in zenith up to MAX_ZENITH degrees
+START_TIME = 1531490000.0 # Timestamp of the first event in seconds
+EVENT_RATE = 1.0 # Mean number of events per second
+
+TRUTH_DTYPE = np.dtype([("event_id", np.int64), ("time_stamp", np.float64), ("pulse", bool),
+                        ("azimuth", np.float64), ("zenith", np.float64), ("arrival_time", np.float64)])
+
+WRITE_CHUNK_SIZE = 64 # Events per executemany
+
+
+# Sample times in ns as processSQL.py computes them
+def sample_times(record_length, post_trigger, sampling_freq):
+    bin_shift = int(int(record_length) * float(100 - post_trigger) / 100)
+
+    return (np.arange(record_length) - bin_shift) / sampling_freq * 10**9
+
+
+def pulse_shape(t):
+    return np.exp(-np.square(t / PULSE_WIDTH)) * np.sin(2 * np.pi * PULSE_FREQUENCY * 10**(-9) * t)
+
+
+# Writes the database to path and returns the TRUTH_DTYPE array of the events
+def generate(path, events, record_length = RECORD_LENGTH, channels = NUMBER_OF_CHANNELS, noise = NOISE,
+             pulse_fraction = PULSE_FRACTION, amplitude = PULSE_AMPLITUDE, post_trigger = POST_TRIGGER,
+             sampling_freq = SAMPLING_FREQUENCY, positions = ANTENNA_POSITIONS, seed = 0):
+    positions = np.asarray(positions, dtype = np.float64)
+    if channels > 2 * len(positions):
+        raise ValueError(str(channels) + " channels need " + str((channels + 1) // 2) + " antennas, the layout has " + str(len(positions)))
+
+    rng = np.random.default_rng(seed)
+    time = sample_times(record_length, post_trigger, sampling_freq)
+    baseline = np.trunc((2**ADC_BITS - 1) * (DC_OFFSET / DC_OFFSET_RANGE))
+
+    truth = np.zeros(events, dtype = TRUTH_DTYPE)
+    truth["event_id"] = np.arange(1, events + 1)
+    truth["time_stamp"] = START_TIME + np.cumsum(rng.exponential(1.0 / EVENT_RATE, events))
+    truth["pulse"] = rng.random(events) < pulse_fraction
+    truth["azimuth"] = rng.uniform(0, 360, events)
+    truth["zenith"] = rng.uniform(0, MAX_ZENITH, events)
+    truth["arrival_time"] = PULSE_TIME + rng.uniform(-PULSE_JITTER, PULSE_JITTER, events)
+
+    # Arrival time of the pulse at each channel, channel c belongs to antenna c // 2
+    antenna_times = arrival_times(positions, truth["azimuth"], truth["zenith"]) + truth["arrival_time"][:, np.newaxis]
+    channel_times = antenna_times[:, np.arange(channels) // 2]
+
+    if os.path.exists(path):
+        os.remove(path)
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.execute("CREATE TABLE digitizer(frequency REAL)")
+        conn.execute("CREATE TABLE settings_root(record_length INT, post_trigger INT)")
+        conn.execute("CREATE TABLE settings_dcoffsets(channel INT, offset INT)")
+        conn.execute("CREATE TABLE events(id INTEGER PRIMARY KEY, time_stamp REAL)")
+        conn.execute("CREATE TABLE samples(event_id INT, channel INT, samples TEXT)")
+        conn.execute("CREATE TABLE synthetic_truth(event_id INTEGER PRIMARY KEY, pulse INTEGER, azimuth REAL, zenith REAL, arrival_time REAL)")
+
+        conn.execute("INSERT INTO digitizer VALUES (?)", (sampling_freq,))
+        conn.execute("INSERT INTO settings_root VALUES (?, ?)", (record_length, post_trigger))
+        conn.executemany("INSERT INTO settings_dcoffsets VALUES (?, ?)", [(channel, DC_OFFSET) for channel in range(channels)])
+
+    for start in range(0, events, WRITE_CHUNK_SIZE):
+        stop = min(start + WRITE_CHUNK_SIZE, events)
+        adc = baseline + rng.normal(0, noise, (stop - start, channels, record_length))
+        for i in np.flatnonzero(truth["pulse"][start:stop]):
+            adc[i] += amplitude * pulse_shape(time[np.newaxis, :] - channel_times[start + i][:, np.newaxis])
+        adc = np.clip(np.rint(adc), 0, 2**ADC_BITS - 1).astype(np.int64)
+
+        with conn:
+            conn.executemany("INSERT INTO events VALUES (?, ?)",
+                             [(int(row["event_id"]), float(row["time_stamp"])) for row in truth[start:stop]])
+            conn.executemany("INSERT INTO samples VALUES (?, ?, ?)",
+                             [(int(truth["event_id"][start + i]), channel, " ".join(map(str, adc[i, channel].tolist())))
+                              for i in range(stop - start) for channel in range(channels)])
+            conn.executemany("INSERT INTO synthetic_truth VALUES (?, ?, ?, ?, ?)",
+                             [(int(row["event_id"]), int(row["pulse"]), float(row["azimuth"]), float(row["zenith"]), float(row["arrival_time"]))
+                              for row in truth[start:stop]])
+
+    conn.close()
+
+    return truth
+
+
+# Reads the synthetic_truth table of a generated database as a TRUTH_DTYPE array
+def load_truth(conn):
+    rows = conn.execute("SELECT events.id, events.time_stamp, pulse, azimuth, zenith, arrival_time FROM synthetic_truth "
+                        "JOIN events ON events.id = synthetic_truth.event_id ORDER BY events.id").fetchall()
+
+    return np.array([tuple(row) for row in rows], dtype = TRUTH_DTYPE)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Write a synthetic WaveDump database with plane wave pulses.")
+    parser.add_argument("output", help = "database file to write")
+    parser.add_argument("-events", type = int, default = 1000, help = "number of events")
+    parser.add_argument("-length", type = int, default = RECORD_LENGTH, help = "record length in samples")
+    parser.add_argument("-channels", type = int, default = NUMBER_OF_CHANNELS, help = "number of channels")
+    parser.add_argument("-noise", type = float, default = NOISE, help = "noise standard deviation in ADC counts")
+    parser.add_argument("-amplitude", type = float, default = PULSE_AMPLITUDE, help = "pulse amplitude in ADC counts")
+    parser.add_argument("-pulses", type = float, default = PULSE_FRACTION, help = "fraction of events with a pulse")
+    parser.add_argument("-seed", type = int, default = 0, help = "random seed")
+    args = parser.parse_args()
+
+    truth = generate(args.output, args.events, args.length, args.channels, args.noise, args.pulses, args.amplitude, seed = args.seed)
+    print("Wrote " + str(len(truth)) + " events (" + str(int(truth["pulse"].sum())) + " with a pulse) to " + args.output)
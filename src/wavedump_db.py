@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+
+# Access to the events of a WaveDump database without loading whole tables.
+# Events are read in chunks of ascending id (keyset pagination), so memory is
+# bounded by the chunk size and the first event is available right away.
+#
+# WaveDump writes no index on samples, so every lookup of the samples of an event
+# range would scan the whole table. index_samples gives the connection an index on
+# (event_id, channel): the one of the database, one created in it, or a sidecar file
+# next to it which maps (event_id, channel) to the rowid of the samples row, so that
+# the database itself stays untouched. All queries are constant SQL with parameters,
+# which sqlite3 prepares once and reuses from its statement cache.
+
+import os
+import sqlite3
+from urllib.parse import quote
+
+
+EVENT_CHUNK_SIZE = 64 # Number of events fetched from the database at once
+
+MMAP_SIZE = 256 * 2**20 # Bytes of the database file memory-mapped by a read-only connection
+CACHE_SIZE = 64 * 2**20 # Bytes of page cache of a read-only connection
+
+SAMPLES_INDEX = "samples_event_channel"
+SIDECAR_SUFFIX = ".index"
+INDEX_MODES = ["auto", "create", "sidecar", "none"]
+
+SAMPLES_QUERY = ("SELECT event_id, channel, samples FROM samples WHERE event_id BETWEEN ? AND ? "
+                 "ORDER BY event_id, channel")
+SIDECAR_SAMPLES_QUERY = ("SELECT rows.event_id, rows.channel, samples.samples FROM sidecar.sample_rows AS rows "
+                         "JOIN main.samples AS samples ON samples.rowid = rows.sample_rowid "
+                         "WHERE rows.event_id BETWEEN ? AND ? ORDER BY rows.event_id, rows.channel")
+
+
+# Connection which knows how to read the samples of an event range, see index_samples
+class WaveDumpConnection(sqlite3.Connection):
+    samples_query = SAMPLES_QUERY
+
+
+def uri(db_file, mode):
+    return "file:" + quote(os.path.abspath(db_file)) + "?mode=" + mode
+
+
+# Read-only connection, which never blocks the acquisition writing to the file
+def connect_readonly(db_file, mmap_size = MMAP_SIZE, cache_size = CACHE_SIZE):
+    conn = sqlite3.connect(uri(db_file, "ro"), uri = True, factory = WaveDumpConnection)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA mmap_size = " + str(int(mmap_size)))
+    conn.execute("PRAGMA cache_size = " + str(-int(cache_size // 1024))) # Negative values are KiB
+
+    return conn
+
+
+# Sampling frequency in Hz, record length in samples and post trigger in percent
+def read_settings(conn):
+    frequency = conn.execute("SELECT frequency FROM digitizer").fetchone()[0]
+    record_length, post_trigger = conn.execute("SELECT record_length, post_trigger FROM settings_root").fetchone()
+
+    return frequency, int(record_length), int(post_trigger)
+
+
+# True if the database has an index on samples which starts with event_id
+def has_samples_index(conn):
+    for index in conn.execute("PRAGMA main.index_list(samples)").fetchall():
+        columns = conn.execute("PRAGMA main.index_info(" + quote_name(index[1]) + ")").fetchall()
+        if len(columns) != 0 and columns[0][2] == "event_id":
+            return True
+
+    return False
+
+
+def quote_name(name):
+    return "\"" + name.replace("\"", "\"\"") + "\""
+
+
+# Adds the index on samples(event_id, channel) to the database file itself
+def create_samples_index(db_file):
+    conn = sqlite3.connect(db_file)
+    with conn:
+        conn.execute("CREATE INDEX IF NOT EXISTS " + SAMPLES_INDEX + " ON samples (event_id, channel)")
+    conn.close()
+
+
+# Attaches the sidecar index of db_file to conn and adds the samples rows written
+# since it was last updated. A sidecar which does not match the database is rebuilt.
+def attach_sidecar(conn, db_file):
+    sidecar = db_file + SIDECAR_SUFFIX
+    if "sidecar" not in [row[1] for row in conn.execute("PRAGMA database_list").fetchall()]:
+        conn.execute("ATTACH DATABASE ? AS sidecar", (uri(sidecar, "rwc"),))
+
+    with conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS sidecar.sample_rows (sample_rowid INTEGER PRIMARY KEY, event_id INTEGER, channel INTEGER)")
+        conn.execute("CREATE INDEX IF NOT EXISTS sidecar.sample_rows_event ON sample_rows (event_id, channel)")
+
+        # The last indexed row must still be the same samples row, otherwise the file was replaced
+        last = conn.execute("SELECT sample_rowid, event_id, channel FROM sidecar.sample_rows ORDER BY sample_rowid DESC LIMIT 1").fetchone()
+        if last is not None:
+            row = conn.execute("SELECT event_id, channel FROM main.samples WHERE rowid = ?", (last[0],)).fetchone()
+            if row is None or tuple(row) != tuple(last[1:]):
+                conn.execute("DELETE FROM sidecar.sample_rows")
+                last = None
+
+        conn.execute("INSERT INTO sidecar.sample_rows SELECT rowid, event_id, channel FROM main.samples WHERE rowid > ?",
+                     (last[0] if last is not None else -1,))
+
+
+# Makes conn read the samples through an index on (event_id, channel). mode is one of
+# INDEX_MODES: "auto" uses the index of the database if it has one and a sidecar
+# otherwise, "create" adds the index to the database file. Returns the index used:
+# "database", "sidecar" or None if every read scans the samples table.
+def index_samples(conn, db_file, mode = "auto"):
+    if mode == "none":
+        conn.samples_query = SAMPLES_QUERY
+        return None
+
+    if mode == "create" and not has_samples_index(conn):
+        create_samples_index(db_file)
+
+    if mode != "sidecar" and has_samples_index(conn):
+        conn.samples_query = SAMPLES_QUERY
+        return "database"
+
+    try:
+        attach_sidecar(conn, db_file)
+    except sqlite3.Error:
+        conn.samples_query = SAMPLES_QUERY # e.g. a read-only directory
+        return None
+
+    conn.samples_query = SIDECAR_SAMPLES_QUERY
+    return "sidecar"
+
+
+# Channel numbers recorded in the samples table, ascending
+def read_channels(conn):
+    return [row[0] for row in conn.execute("SELECT DISTINCT channel FROM samples ORDER BY channel").fetchall()]
+
+
+# DC offset DAC values of channels from settings_dcoffsets. The digitizer also stores
+# offsets of disabled channels, which have no samples.
+def read_dc_offsets(conn, channels):
+    offsets = dict(conn.execute("SELECT channel, offset FROM settings_dcoffsets").fetchall())
+    missing = [channel for channel in channels if channel not in offsets]
+    if len(missing) != 0:
+        raise ValueError("settings_dcoffsets has no offset for channel " + ", ".join(str(channel) for channel in missing))
+
+    return [offsets[channel] for channel in channels]
+
+
+def count_events(conn):
+    return conn.execute("SELECT COUNT(*) FROM events").fetchone()[0]
+
+
+# Yields lists of up to chunk_size (event_id, time_stamp, channels) tuples for the
+# events at positions [start, stop) in id order. channels holds the samples
+# strings ordered by channel number, or None if with_samples is False.
+def iter_event_chunks(conn, start = 0, stop = None, chunk_size = EVENT_CHUNK_SIZE, with_samples = True):
+
+    c = conn.cursor()
+
+    if stop is None:
+        stop = count_events(conn)
+    remaining = stop - start
+    if remaining <= 0:
+        return
+
+    first = c.execute("SELECT id FROM events ORDER BY id LIMIT 1 OFFSET ?", (start,)).fetchone()
+    if first is None:
+        return
+
+    events = c.execute("SELECT id, time_stamp FROM events WHERE id >= ? ORDER BY id LIMIT ?",
+                       (first[0], min(chunk_size, remaining))).fetchall()
+
+    while events:
+        last_id = events[-1][0]
+        yield read_samples(c, events, with_samples)
+
+        remaining -= len(events)
+        if remaining <= 0:
+            return
+
+        events = c.execute("SELECT id, time_stamp FROM events WHERE id > ? ORDER BY id LIMIT ?",
+                           (last_id, min(chunk_size, remaining))).fetchall()
+
+
+# Adds the samples strings of each channel to (event_id, time_stamp) rows of consecutive events
+def read_samples(c, events, with_samples = True):
+    samples = {}
+    if with_samples and events:
+        c.execute(getattr(c.connection, "samples_query", SAMPLES_QUERY), (events[0][0], events[-1][0]))
+        for event_id, channel, text in c.fetchall():
+            samples.setdefault(event_id, []).append(text)
+
+    return [(event_id, time_stamp, samples.pop(event_id, []) if with_samples else None)
+            for event_id, time_stamp in events]
+
+
+# Up to chunk_size events with an id above after_id, like one chunk of iter_event_chunks
+def events_after(conn, after_id, chunk_size = EVENT_CHUNK_SIZE, with_samples = True):
+    c = conn.cursor()
+    events = c.execute("SELECT id, time_stamp FROM events WHERE id > ? ORDER BY id LIMIT ?", (after_id, chunk_size)).fetchall()
+
+    return read_samples(c, events, with_samples)
+
+
+# Number of events with an id above after_id
+def count_events_after(conn, after_id):
+    return conn.execute("SELECT COUNT(*) FROM events WHERE id > ?", (after_id,)).fetchone()[0]
+
+
+# Same as iter_event_chunks, one event at a time
+def iter_events(conn, start = 0, stop = None, chunk_size = EVENT_CHUNK_SIZE, with_samples = True):
+    for chunk in iter_event_chunks(conn, start, stop, chunk_size, with_samples):
+        for event in chunk:
+            yield event
+
+
+# Position in id order of the event after event_id, i.e. the number of events up to it
+def event_position(conn, event_id):
+    return conn.execute("SELECT COUNT(*) FROM events WHERE id <= ?", (event_id,)).fetchone()[0]
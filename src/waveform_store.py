@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+
+# Converts a WaveDump SQLite database into a binary waveform store once, so that
+# later analysis runs can memory-map the raw ADC values instead of re-parsing
+# the text in the samples table.
+#
+# A store is a directory holding
+#     waveforms.npy  (events, channels, record_length) int16 ADC values
+#     index.npy      one (id, time_stamp, offset) record per event
+#     meta.json      run settings needed by the analysis (frequency, offsets, ...)
+#
+# Usage: python waveform_store.py WaveDump_20180713_144835.db [-o store_dir]
+
+import os
+import sys
+import json
+import argparse
+import numpy as np
+
+from sample_decoder import ADC_DTYPE
+from wavedump_db import connect_readonly, read_settings, read_channels, read_dc_offsets
+
+
+WAVEFORM_FILE = "waveforms.npy"
+INDEX_FILE = "index.npy"
+META_FILE = "meta.json"
+
+# offset is the byte position of the event inside the data block of waveforms.npy
+INDEX_DTYPE = np.dtype([("id", np.int64), ("time_stamp", np.float64), ("offset", np.int64)])
+
+INGEST_CHUNK_SIZE = 512 # Number of samples rows fetched from the database at once
+
+
+# Default location of the store belonging to a database (next to the .db file)
+def default_store_dir(db_file):
+    return os.path.splitext(db_file)[0] + ".store"
+
+
+# Parses one space separated samples string into ADC counts
+def parse_samples(text):
+    return np.fromstring(text, dtype = ADC_DTYPE, sep = " ")
+
+
+def ingest(db_file, store_dir = None, chunk_size = INGEST_CHUNK_SIZE):
+
+    if store_dir is None:
+        store_dir = default_store_dir(db_file)
+
+    conn = connect_readonly(db_file)
+    c = conn.cursor()
+
+    sampling_freq, record_length, post_trigger = read_settings(conn)
+    channels = read_channels(conn)
+    dc_offsets = read_dc_offsets(conn, channels)
+    channel_pos = {channel: i for i, channel in enumerate(channels)}
+
+    index = np.zeros(c.execute("SELECT COUNT(*) FROM events").fetchone()[0], dtype = INDEX_DTYPE)
+    for pos, (event_id, time_stamp) in enumerate(c.execute("SELECT id, time_stamp FROM events ORDER BY id")):
+        index[pos]["id"] = event_id
+        index[pos]["time_stamp"] = time_stamp
+    event_pos = {int(event_id): pos for pos, event_id in enumerate(index["id"])}
+
+    event_bytes = len(channels) * record_length * np.dtype(np.int16).itemsize
+    index["offset"] = np.arange(len(index), dtype = np.int64) * event_bytes
+
+    if not os.path.isdir(store_dir):
+        os.makedirs(store_dir)
+
+    waveforms = np.lib.format.open_memmap(os.path.join(store_dir, WAVEFORM_FILE), mode = "w+", dtype = np.int16,
+                                          shape = (len(index), len(channels), record_length))
+
+    # The samples table is read once in storage order, so no sort or index is needed
+    c.execute("SELECT event_id, channel, samples FROM samples")
+    while True:
+        rows = c.fetchmany(chunk_size)
+        if not rows:
+            break
+
+        for event_id, channel, samples in rows:
+            adc_values = parse_samples(samples)
+            if len(adc_values) != record_length:
+                raise ValueError("Event " + str(event_id) + " channel " + str(channel) + " has " + str(len(adc_values)) +
+                                 " samples, expected a record length of " + str(record_length))
+            waveforms[event_pos[event_id], channel_pos[channel]] = adc_values
+
+    waveforms.flush()
+    del waveforms
+    conn.close()
+
+    np.save(os.path.join(store_dir, INDEX_FILE), index)
+
+    meta = {
+        "source": os.path.abspath(db_file),
+        "source_mtime": os.path.getmtime(db_file),
+        "sampling_freq": sampling_freq,
+        "record_length": record_length,
+        "post_trigger": post_trigger,
+        "dc_offsets": dc_offsets,
+        "channels": channels,
+        "events": len(index),
+    }
+    with open(os.path.join(store_dir, META_FILE), "w") as meta_file:
+        json.dump(meta, meta_file, indent = 4)
+
+    return store_dir
+
+
+# Read-only view of a store. The waveforms are memory-mapped, so only the pages
+# of the events that are actually accessed are read from disk.
+class WaveformStore(object):
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+
+        with open(os.path.join(store_dir, META_FILE), "r") as meta_file:
+            self.meta = json.load(meta_file)
+
+        self.waveforms = np.load(os.path.join(store_dir, WAVEFORM_FILE), mmap_mode = "r")
+        self.index = np.load(os.path.join(store_dir, INDEX_FILE))
+
+        self.sampling_freq = self.meta["sampling_freq"]
+        self.record_length = self.meta["record_length"]
+        self.post_trigger = self.meta["post_trigger"]
+        self.dc_offsets = self.meta["dc_offsets"]
+        self.channels = self.meta["channels"]
+
+    def __len__(self):
+        return len(self.index)
+
+    # True if the source database was modified after the store was written
+    def is_stale(self):
+        source = self.meta["source"]
+        return os.path.exists(source) and os.path.getmtime(source) > self.meta["source_mtime"]
+
+    # ADC values of the event at position row, shape (channels, record_length)
+    def event(self, row):
+        return self.waveforms[row]
+
+    # ADC values of the events in [start, stop), shape (events, channels, record_length)
+    def events(self, start, stop):
+        return self.waveforms[start:stop]
+
+    # Position of an event id in the store
+    def find(self, event_id):
+        pos = int(np.searchsorted(self.index["id"], event_id))
+        if pos == len(self.index) or self.index[pos]["id"] != event_id:
+            raise KeyError("Event id " + str(event_id) + " is not in the store " + self.store_dir)
+
+        return pos
+
+
+# Opens the store of a database with the given channels and record length. Raises
+# ValueError if files are missing or the store was written for other data.
+def open_store(store_dir, channels, record_length):
+    for name in (META_FILE, WAVEFORM_FILE, INDEX_FILE):
+        if not os.path.isfile(os.path.join(store_dir, name)):
+            raise ValueError("Waveform store " + store_dir + " has no " + name)
+
+    try:
+        store = WaveformStore(store_dir)
+    except (OSError, KeyError) as e:
+        raise ValueError("Waveform store " + store_dir + " cannot be read: " + str(e))
+
+    if store.channels != list(channels):
+        raise ValueError("Waveform store " + store_dir + " has the channels " + str(store.channels) +
+                         ", the input file " + str(list(channels)))
+    if store.record_length != record_length:
+        raise ValueError("Waveform store " + store_dir + " has a record length of " + str(store.record_length) +
+                         ", the input file " + str(record_length))
+    if store.waveforms.shape != (len(store), len(channels), record_length):
+        raise ValueError("Waveform store " + store_dir + " holds waveforms of shape " + str(store.waveforms.shape) +
+                         ", expected " + str((len(store), len(channels), record_length)))
+
+    return store
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = "Convert a WaveDump database into a memory-mapped waveform store.")
+    parser.add_argument("db_file", help = "WaveDump_*.db file to convert")
+    parser.add_argument("-o", dest = "STORE_DIR", default = None,
+                        help = "output directory of the store (default: next to the database)")
+    parser.add_argument("-chunk", type = int, dest = "CHUNK_SIZE", default = INGEST_CHUNK_SIZE,
+                        help = "number of sample rows fetched from the database at once")
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db_file):
+        print("Database " + args.db_file + " does not exist. Exitting...")
+        sys.exit(1)
+
+    store_dir = ingest(args.db_file, args.STORE_DIR, args.CHUNK_SIZE)
+    print("Waveform store written to \"" + store_dir + "\"")